@@ -0,0 +1,94 @@
+from app.processor.embedding_cache import EmbeddingCache
+from langchain_core.embeddings import Embeddings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Iterator, Optional, Tuple
+import time
+
+
+class BatchEmbedder:
+    """
+    Embeds texts in batches, keeping up to `max_concurrency` batch requests in flight.
+    Failed batches are retried with exponential backoff.
+    If a cache is given, texts already embedded by `model` with the same prefix are not sent again.
+    """
+
+    def __init__(self, embeddings : Embeddings,
+                 batch_size : int = 32,
+                 max_concurrency : int = 4,
+                 max_retries : int = 3,
+                 retry_delay : float = 1.0,
+                 cache : Optional[EmbeddingCache] = None,
+                 model : str = ''):
+        self.embeddings = embeddings
+        self.batch_size = max(batch_size, 1)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.cache = cache
+        self.model = model
+
+    def embed_batch(self, texts : List[str]) -> List[List[float]]:
+        """Embeds a single batch, retrying it on failure."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                print(f"Error embedding batch of {len(texts)} text(s): {e}. Retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+    def iter_batches(self, texts : List[str], prefix : str = '') -> Iterator[Tuple[int, List[List[float]]]]:
+        """
+        Embeds the texts, prepended with prefix, and yields (start index, vectors) for every batch, in order.
+        Batches are yielded as soon as they and all the batches before them are done. The cache is not used.
+        """
+        starts = range(0, len(texts), self.batch_size)
+        batches = [[prefix + text for text in texts[start:start + self.batch_size]] for start in starts]
+        if self.max_concurrency == 1 or len(starts) <= 1:
+            for start, batch in zip(starts, batches):
+                yield start, self.embed_batch(batch)
+            return
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            # map submits every batch, but only max_concurrency of them run at the same time
+            for start, vectors in zip(starts, executor.map(self.embed_batch, batches)):
+                yield start, vectors
+
+    def iter_embed(self, texts : List[str], prefix : str = '') -> Iterator[Tuple[int, List[List[float]]]]:
+        """
+        Embeds all texts, prepended with prefix, and yields (start index, vectors) of consecutive slices of texts,
+        in order, as soon as all their vectors are known.
+        Cached texts are not embedded again, and each distinct uncached text is embedded only once.
+        """
+        if self.cache is None:
+            yield from self.iter_batches(texts, prefix)
+            return
+        vectors = self.cache.get_many(self.model, prefix, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        embedded : Dict[str, List[float]] = {}
+        done = 0 # texts before done were already yielded
+
+        def advance() -> Iterator[Tuple[int, List[List[float]]]]:
+            nonlocal done
+            start = done
+            while done < len(texts) and (vectors[done] is not None or texts[done] in embedded):
+                if vectors[done] is None:
+                    vectors[done] = embedded[texts[done]]
+                done += 1
+            if done > start:
+                yield start, vectors[start:done]
+
+        yield from advance() # leading cached texts
+        for start, batch_vectors in self.iter_batches(missing, prefix):
+            batch_texts = missing[start:start + len(batch_vectors)]
+            self.cache.put_many(self.model, prefix, batch_texts, batch_vectors)
+            embedded.update(zip(batch_texts, batch_vectors))
+            yield from advance()
+
+    def embed(self, texts : List[str], prefix : str = '') -> List[List[float]]:
+        """Embeds all texts, prepended with prefix, returning the vectors in the same order."""
+        vectors = []
+        for _, batch_vectors in self.iter_embed(texts, prefix):
+            vectors.extend(batch_vectors)
+        return vectors
@@ -0,0 +1,169 @@
+from app.config_loader import ConfigLoader
+from langchain_core.embeddings import Embeddings
+from typing import Dict, List, Optional
+from array import array
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import os
+
+_CACHE_PATH = os.path.join("app", "storage", "sqlite", "embeddings.db")
+
+
+class EmbeddingCache:
+    """
+    Singleton persistent cache of text embeddings, shared by ingestion and query time.
+    Entries are keyed by the hash of the model id, the prefix and the text, so a chunk is embedded
+    only once per model, whatever paper it comes from. When the cache holds more than
+    `embedding_cache_max_entries` entries, the least recently used ones are evicted.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = super(EmbeddingCache, cls).__new__(cls)
+                cls._instance._init_cache()
+        return cls._instance
+
+    def _init_cache(self) -> None:
+        """Opens the cache database, creating it if needed."""
+        emb_config = ConfigLoader().get_config()['embedding_config']
+        self.max_entries = emb_config['embedding_cache_max_entries']
+        os.makedirs(os.path.dirname(_CACHE_PATH), exist_ok=True)
+        # the connection is shared by every thread, access is serialized by the lock
+        self._conn = sqlite3.connect(_CACHE_PATH, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        with self._lock:
+            self._conn.execute("""\
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key CHAR(64) PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._conn.commit()
+
+    @staticmethod
+    def get_key(model : str, prefix : str, text : str) -> str:
+        """Returns the cache key of the text embedded by the model with the given prefix."""
+        return hashlib.sha256('\0'.join((model, prefix, text)).encode('utf-8')).hexdigest()
+
+    def get_many(self, model : str, prefix : str, texts : List[str]) -> List[Optional[List[float]]]:
+        """
+        Returns the cached embedding of every text, None for the ones that are not cached.
+        Found entries are marked as recently used.
+        """
+        keys = [self.get_key(model, prefix, text) for text in texts]
+        found : Dict[str, List[float]] = {}
+        with self._lock:
+            for start in range(0, len(keys), 500): # stay below the sqlite variable limit
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update((key, array('d', vector).tolist()) for key, vector in rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+            hits = sum(key in found for key in keys)
+            self._stats['hits'] += hits
+            self._stats['misses'] += len(keys) - hits
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model : str, prefix : str, texts : List[str], vectors : List[List[float]]) -> None:
+        """Caches the embeddings of the texts, evicting the least recently used entries if the cache is full."""
+        now = time.time()
+        rows = [
+            (self.get_key(model, prefix, text), model, array('d', vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?,?,?,?)", rows)
+            num_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if num_entries > self.max_entries:
+                evicted = num_entries - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (evicted,)
+                )
+                self._stats['evictions'] += evicted
+            self._conn.commit()
+
+    def get_stats(self) -> Dict[str, float]:
+        """Returns the hits, misses and evictions since startup, the hit rate and the number of entries."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def print_stats(self) -> None:
+        """Prints the cache statistics."""
+        stats = self.get_stats()
+        print(f"Embedding cache: {stats['hits']} hit(s), {stats['misses']} miss(es) "
+              f"({stats['hit_rate']:.1%} hit rate), {stats['entries']} entries, {stats['evictions']} evicted")
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Returns the shared embedding cache, None if use_embedding_cache is not set."""
+    if not ConfigLoader().get_config()['embedding_config']['use_embedding_cache']:
+        return None
+    return EmbeddingCache()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings that look texts up in the EmbeddingCache before calling the wrapped embeddings.
+    Texts are cached as they are given, with an empty prefix.
+    """
+
+    def __init__(self, embeddings : Embeddings, model : str, cache : EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts : List[str]) -> List[List[float]]:
+        vectors = self.cache.get_many(self.model, '', texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            missing_vectors = self.embeddings.embed_documents(missing_texts)
+            self.cache.put_many(self.model, '', missing_texts, missing_vectors)
+            for i, vector in zip(missing, missing_vectors):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text : str) -> List[float]:
+        vector = self.cache.get_many(self.model, '', [text])[0]
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put_many(self.model, '', [text], [vector])
+        return vector
+
+    async def aembed_documents(self, texts : List[str]) -> List[List[float]]:
+        vectors = await asyncio.to_thread(self.cache.get_many, self.model, '', texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            missing_vectors = await self.embeddings.aembed_documents(missing_texts)
+            await asyncio.to_thread(self.cache.put_many, self.model, '', missing_texts, missing_vectors)
+            for i, vector in zip(missing, missing_vectors):
+                vectors[i] = vector
+        return vectors
+
+    async def aembed_query(self, text : str) -> List[float]:
+        vector = (await asyncio.to_thread(self.cache.get_many, self.model, '', [text]))[0]
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self.cache.put_many, self.model, '', [text], [vector])
+        return vector
@@ -0,0 +1,87 @@
+from app.config_loader import ConfigLoader
+from app.scraper.scraper import ImageData
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import List, Tuple
+from PIL import Image
+import threading
+import base64
+import os
+
+_FORMATS = {'jpeg': ('JPEG', 'jpg', 'image/jpeg'), 'webp': ('WEBP', 'webp', 'image/webp')}
+_MIME_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.webp': 'image/webp'}
+
+# base64 payloads of the last images sent to the LLM, shared by every session
+_payload_cache : "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+_payload_lock = threading.Lock()
+
+
+class FigureStore:
+    """
+    Stores the figures of the papers. Every figure is saved as the original PNG, shown in the chat,
+    and as a downscaled JPEG or WebP variant sent to the multimodal LLM. Figures are encoded in parallel.
+    """
+
+    def __init__(self, base_dir : str = os.path.join('app', 'storage', 'images')):
+        figure_config = ConfigLoader().get_config()['figure_config']
+        if figure_config['llm_format'] not in _FORMATS:
+            raise ValueError(f"Unknown LLM image format: {figure_config['llm_format']}")
+        self.base_dir = base_dir
+        self.png_compress_level = figure_config['png_compress_level']
+        self.llm_format = figure_config['llm_format']
+        self.llm_max_size = figure_config['llm_max_size']
+        self.llm_quality = figure_config['llm_quality']
+        self.num_workers = max(figure_config['num_workers'], 1)
+
+    def make_llm_variant(self, img : Image.Image) -> Image.Image:
+        """Returns the image downscaled to fit llm_max_size, in a mode the LLM format can encode."""
+        img = img.convert('RGB') if img.mode not in ('RGB', 'L') else img.copy()
+        img.thumbnail((self.llm_max_size, self.llm_max_size), Image.Resampling.LANCZOS) # never upscales
+        return img
+
+    def save_figure(self, img : Image.Image, base_path : str) -> Tuple[str, str]:
+        """Saves the original and the LLM variant of the figure, returning their paths."""
+        img_path = base_path + '.png'
+        img.save(img_path, compress_level=self.png_compress_level)
+        pil_format, extension, _ = _FORMATS[self.llm_format]
+        llm_path = f"{base_path}_llm.{extension}"
+        self.make_llm_variant(img).save(llm_path, pil_format, quality=self.llm_quality)
+        return img_path, llm_path
+
+    def save(self, paper_id : str, image_data : ImageData) -> List[Tuple[str, str]]:
+        """
+        Saves the figures of the paper in parallel.
+        Args:
+            paper_id (str): ID of the paper.
+            image_data (ImageData): Figures to save.
+        Returns:
+            List[Tuple[str, str]]: Paths of the original and of the LLM variant of every figure.
+        """
+        paper_dir = os.path.join(self.base_dir, paper_id)
+        os.makedirs(paper_dir, exist_ok=True) # Create directory with paper id
+        base_paths = [os.path.join(paper_dir, f"fig_{mdt['page_id']}_{mdt['fig_id']}") for _, mdt in image_data]
+        if self.num_workers == 1 or len(image_data) <= 1:
+            return [self.save_figure(img, path) for (img, _), path in zip(image_data, base_paths)]
+        # PIL releases the GIL while encoding, so threads encode figures in parallel
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            return list(executor.map(self.save_figure, [img for img, _ in image_data], base_paths))
+
+
+def get_image_payload(path : str) -> Tuple[str, str]:
+    """
+    Returns the MIME type and the base64 encoding of the image file, to be sent to the LLM.
+    Payloads are kept in an LRU cache of figure_config.payload_cache_size entries.
+    """
+    cache_size = ConfigLoader().get_config()['figure_config']['payload_cache_size']
+    with _payload_lock:
+        if path in _payload_cache:
+            _payload_cache.move_to_end(path)
+            return _payload_cache[path]
+    with open(path, "rb") as f:
+        data = base64.b64encode(f.read()).decode("utf-8")
+    payload = (_MIME_TYPES.get(os.path.splitext(path)[1].lower(), 'image/png'), data)
+    with _payload_lock:
+        _payload_cache[path] = payload
+        while len(_payload_cache) > cache_size:
+            _payload_cache.popitem(last=False)
+    return payload
@@ -1,15 +1,23 @@
 from app.processor.processor import Processor
+from app.processor.embedding import BatchEmbedder
+from app.processor.embedding_cache import CachedEmbeddings, get_embedding_cache
+from app.processor.figure_store import FigureStore
+from app.processor.splitter_registry import SplitterRegistry
+from app.processor.pipeline import StageTimings, run_stages, run_branches
 from app.scraper.scraper import ImageData
-from app.scripts.utils import embed_image
-from app.scripts.db_helper import insert_paper_info
-from typing import List, Any
+from app.scripts.utils import embed_images
+from app.scripts.db_helper import insert_paper_info, save_paper_markdown
+from typing import List, Any, Dict, Iterable, Iterator, Tuple, Optional
 from qdrant_client import QdrantClient, models
 from langchain_core.documents import Document
 from langchain_qdrant import QdrantVectorStore
-from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
-from transformers import AutoTokenizer, PreTrainedTokenizer, PreTrainedTokenizerFast
+from itertools import islice
+import hashlib
 import re
-from uuid import uuid4
+from uuid import uuid5, NAMESPACE_URL
+import threading
+import queue
+import time
 import os
 
 
@@ -25,30 +33,42 @@ class LangchainProcessor(Processor):
                  img_emb : Any,
                  img_proc : Any):
         super().__init__(md_data, image_data, paper_id, text_vector_store, img_emb, img_proc)
-        self.tokenizer = self.load_tokenizer_model(self.configs['embedding_config']['tokenizer'])
+        registry = SplitterRegistry()
+        self.tokenizer = registry.get_tokenizer(self.configs['embedding_config']['tokenizer'])
         chunk_config = self.configs['chunking_config']
         self.chunk_size = \
             chunk_config['chunk_size'] if not chunk_config['use_emb_model_max_seq_length'] else self.configs['embedding_config']['tokenizer']
         self.chunk_size = self.chunk_size - chunk_config['chunk_size_penalty']
         self.chunk_overlap = int(self.chunk_size * chunk_config['chunk_overlap_percent'])
-        self.markdown_splitter = MarkdownHeaderTextSplitter([("##", "chapter")])
-        self.token_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
-            separators=['. '], # split by sentences
-            keep_separator=True,
-            tokenizer=self.tokenizer, 
-            chunk_size= self.chunk_size,
-            chunk_overlap=self.chunk_overlap
+        emb_config = self.configs['embedding_config']
+        text_embeddings = self.text_vs.embeddings
+        if isinstance(text_embeddings, CachedEmbeddings): # the batch embedder checks the cache itself
+            text_embeddings = text_embeddings.embeddings
+        self.embedding_cache = get_embedding_cache()
+        self.text_embedder = BatchEmbedder(
+            text_embeddings,
+            batch_size=emb_config['batch_size'],
+            max_concurrency=emb_config['max_concurrent_requests'],
+            max_retries=emb_config['max_retries'],
+            cache=self.embedding_cache,
+            model=emb_config['model']
         )
-
-    def load_tokenizer_model(self, model_name : str) -> PreTrainedTokenizer|PreTrainedTokenizerFast:
-        """Loads the tokenizer of the Embedding Model used by the Embedding Server."""
-        try:
-            token = AutoTokenizer.from_pretrained(model_name)
-        except Exception as e:
-            print(f"Error loading tokenizer: {e}. Trying to download...")
-            token = AutoTokenizer.from_pretrained(model_name, force_download=True)
-        
-        return token
+        self.figure_store = FigureStore()
+        self.upsert_lock = threading.Lock() # the text and image branches share the qdrant client
+        self.chunk_counts : Dict[str, int] = {} # occurrences of every chunk hash, fragments of a stream continue the count
+        self.markdown_splitter = registry.get_markdown_splitter([("##", "chapter")])
+        if chunk_config['chunker'] == 'offset' and self.tokenizer.is_fast:
+            self.token_splitter = registry.get_token_chunker(
+                self.configs['embedding_config']['tokenizer'],
+                self.chunk_size,
+                self.chunk_overlap
+            )
+        else:
+            self.token_splitter = registry.get_token_splitter(
+                self.configs['embedding_config']['tokenizer'],
+                self.chunk_size,
+                self.chunk_overlap
+            )
     
     def split_md_data(self) -> List[Document]:
         """
@@ -62,17 +82,42 @@ class LangchainProcessor(Processor):
         return splits
 
 
+    def get_point_id(self, kind : str, key : Any) -> str:
+        """
+        Returns the id of a point of the paper. Ids are deterministic, so upserting a paper again
+        after a partial failure overwrites the points already written instead of duplicating them.
+        """
+        return str(uuid5(NAMESPACE_URL, f"{self.paper_id}/{kind}/{key}"))
+
+    def get_embedded_text(self, split : Document) -> str:
+        """Returns the text of the split as it is embedded, with its section title if add_section_titles is set."""
+        if self.configs['chunking_config']['add_section_titles'] and 'chapter' in split.metadata.keys():
+            return f"## {split.metadata['chapter']}\n" + split.page_content
+        return split.page_content
+
+    def get_chunk_hash(self, split : Document) -> str:
+        """Returns the hash of the embedded text of the split and of the settings its vector depends on."""
+        emb_config = self.configs['embedding_config']
+        prefix = emb_config['document_prefix'] if emb_config['use_prefix'] else ''
+        return hashlib.sha256('\0'.join((emb_config['model'], prefix, self.get_embedded_text(split))).encode('utf-8')).hexdigest()
+
     def create_split_metadata(self, md_splits : List[Document]) -> List[str]:
         """
         Creates metadata for each split. Modifies the Document object in place.
         Args:
             md_splits (List[Document]): List of Document objects.
         Returns:
-            List[str]: List of UUIDs.
+            List[str]: List of UUIDs. They are derived from the chunk hash, so unchanged chunks keep their id.
         """
         chapter_num_regex = r'\b\d+(?:\.\d+)*\b'
         fig_ref_ids_regex = r'(?i)\b(?:Figure|Fig\.?) (\d+(?:\.\d+)*)\b'
-        uuids = [str(uuid4()) for _ in range(len(md_splits))]
+        uuids = []
+        for split in md_splits:
+            chunk_hash = self.get_chunk_hash(split)
+            occurrence = self.chunk_counts.get(chunk_hash, 0) # repeated chunks get distinct ids
+            self.chunk_counts[chunk_hash] = occurrence + 1
+            split.metadata['chunk_hash'] = chunk_hash
+            uuids.append(self.get_point_id('text', f"{chunk_hash}_{occurrence}"))
         for i, split in enumerate(md_splits):
             split.metadata['paper_id'] = self.paper_id
             # extract chapter id
@@ -88,6 +133,10 @@ class LangchainProcessor(Processor):
         return uuids
 
                 
+    def save_markdown(self) -> None:
+        """Saves the markdown of the paper, so it can be re-indexed without scraping it again."""
+        save_paper_markdown(self.paper_id, self.md_data)
+
     def insert_paper_info(self, paper_info: Document) -> None:
         """
         Inserts paper info into the database.
@@ -97,97 +146,340 @@ class LangchainProcessor(Processor):
         insert_paper_info(self.paper_id, paper_info.page_content)
 
     
-    def insert_texts_in_vs(self, splits : List[Document], uuids : List[str]) -> None:
+    def embed_texts(self, splits : List[Document]) -> List[List[float]]:
         """
-        Inserts text data into the Qdrant Vector Store.
-        Args:
-            splits (List[Document]): List of Document objects.
+        Embeds the splits in batches, prefixed with the document prefix if use_prefix is set.
+        Splits found in the embedding cache are not embedded again.
         """
-        if self.configs['embedding_config']['use_prefix']:
-            prefix = self.configs['embedding_config']['document_prefix']
-            points = [
+        emb_config = self.configs['embedding_config']
+        prefix = emb_config['document_prefix'] if emb_config['use_prefix'] else ''
+        return self.text_embedder.embed([split.page_content for split in splits], prefix)
+
+    def upsert_points(self, collection_name : str, points : Iterable[models.PointStruct]) -> None:
+        """
+        Upserts the points in batches of upsert_batch_size, building each batch only when it is sent.
+        Failed batches are retried, which is safe since point ids are deterministic.
+        upsert_wait sets which batches wait for qdrant to apply them: all, last (only the final one) or none.
+        """
+        qdrant_config = self.configs['qdrant_config']
+        batch_size = max(qdrant_config['upsert_batch_size'], 1)
+        wait_policy = qdrant_config['upsert_wait']
+        if wait_policy not in ('all', 'last', 'none'):
+            raise ValueError(f"Unknown upsert wait policy: {wait_policy}")
+        qdrant_client : QdrantClient = self.text_vs.client
+        points = iter(points)
+        batch = list(islice(points, batch_size))
+        while batch:
+            next_batch = list(islice(points, batch_size))
+            wait = wait_policy == 'all' or (wait_policy == 'last' and not next_batch)
+            for attempt in range(qdrant_config['upsert_max_retries'] + 1):
+                try:
+                    with self.upsert_lock:
+                        qdrant_client.upsert(collection_name=collection_name, points=batch, wait=wait)
+                    break
+                except Exception as e:
+                    if attempt == qdrant_config['upsert_max_retries']:
+                        raise
+                    print(f"Error upserting batch of {len(batch)} point(s): {e}. Retrying...")
+                    time.sleep(2 ** attempt)
+            batch = next_batch
+
+    def upsert_texts(self, splits : List[Document], uuids : List[str], vectors : List[List[float]]) -> None:
+        """Upserts the embedded splits into the text collection."""
+        self.upsert_points(
+            self.configs['qdrant_config']['text_collection_name'],
+            (
                 models.PointStruct(
                     id=uuids[i],
                     payload={'metadata': split.metadata, 'page_content': split.page_content},
-                    vector=self.text_vs.embeddings.embed_query(prefix+split.page_content)
+                    vector=vectors[i]
                 )
                 for i, split in enumerate(splits)
-            ]
-            self.text_vs.client.upsert(
-                collection_name=self.configs['qdrant_config']['text_collection_name'],
-                points=points
             )
-        else:
-            self.text_vs.add_documents(splits, ids=uuids)
+        )
+
+    def insert_texts_in_vs(self, splits : List[Document], uuids : List[str]) -> None:
+        """
+        Inserts text data into the Qdrant Vector Store.
+        Splits are upserted as soon as their batch is embedded.
+        Args:
+            splits (List[Document]): List of Document objects.
+        """
+        emb_config = self.configs['embedding_config']
+        prefix = emb_config['document_prefix'] if emb_config['use_prefix'] else ''
+        texts = [split.page_content for split in splits]
+        for start, vectors in self.text_embedder.iter_embed(texts, prefix):
+            end = start + len(vectors)
+            self.upsert_texts(splits[start:end], uuids[start:end], vectors)
 
-    def save_images(self) -> List[str]:
+    def save_images(self, image_data : Optional[ImageData] = None) -> List[Tuple[str, str]]:
         """
-        Saves images in Save path.
+        Saves images and their LLM variants in the figure store.
+        Args:
+            image_data (Optional[ImageData]): Images to save, all the image data if None.
         Returns:
-            List[str]: List of image paths.
+            List[Tuple[str, str]]: List of image paths and LLM variant paths.
         """
-        img_paths = []
-        base_path = os.path.join('app', 'storage', 'images', self.paper_id)
-        os.makedirs(base_path, exist_ok=True) # Create directory with paper id
-        for img, mdt in self.image_data:
-            img_name = f"fig_{mdt['page_id']}_{mdt['fig_id']}.png"
-            img_path = os.path.join(base_path, img_name)
-            img_paths.append(img_path)
-            img.save(img_path)
-        return img_paths
+        return self.figure_store.save(self.paper_id, self.image_data if image_data is None else image_data)
 
-    def create_image_metadata(self, img_paths : List[str]) -> None:
+    def create_image_metadata(self, img_paths : List[Tuple[str, str]], image_data : Optional[ImageData] = None) -> None:
         """
         Creates metadata for each image. Modifies the ImageData object in place.
         Args:
-            img_paths (List[str]): List of image paths.
+            img_paths (List[Tuple[str, str]]): List of image paths and LLM variant paths.
+            image_data (Optional[ImageData]): Images of img_paths, all the image data if None.
         """
-        for i, (img, mdt) in enumerate(self.image_data):
+        for i, (img, mdt) in enumerate(self.image_data if image_data is None else image_data):
             mdt['paper_id'] = self.paper_id
-            mdt['path'] = img_paths[i]
+            mdt['path'], mdt['llm_path'] = img_paths[i]
             if 'caption' in mdt.keys(): # add figure reference id
                 ref_id = re.findall(r'(?i)\b(?:Figure|Fig\.?) (\d+(?:\.\d+)*)\b', mdt['caption'])
                 if ref_id: mdt['fig_ref_id'] = ref_id[0]
 
+    def embed_image_data(self, image_data : ImageData) -> List[List[float]]:
+        """Embeds the images in batches."""
+        emb_config = self.configs['embedding_config']
+        return embed_images(
+            [img for img, _ in image_data],
+            self.img_emb,
+            self.img_proc,
+            batch_size=emb_config['image_batch_size'],
+            num_threads=emb_config['image_num_threads']
+        )
+
+    def upsert_images(self, image_data : ImageData, vectors : List[List[float]]) -> None:
+        """Upserts the embedded images into the image collection."""
+        self.upsert_points(
+            self.configs['qdrant_config']['image_collection_name'],
+            (
+                models.PointStruct(
+                    id=self.get_point_id('image', f"{mdt['page_id']}_{mdt['fig_id']}"),
+                    payload={'metadata': mdt, 'page_content': mdt['caption'] if 'caption' in mdt.keys() else ''},
+                    vector=vectors[i]
+                )
+                for i, (img, mdt) in enumerate(image_data)
+            )
+        )
+
     def insert_images_in_vs(self) -> None:
         """
         Inserts image data into the Qdrant Vector Store.
+        Images are embedded and upserted one batch at a time.
         """
-        qdrant_client : QdrantClient = self.text_vs.client
-        points = [
-            models.PointStruct(
-                id=str(uuid4()),
-                payload={'metadata': mdt, 'page_content': mdt['caption'] if 'caption' in mdt.keys() else ''},
-                vector=embed_image(img, self.img_emb, self.img_proc)
-            )
-            for (img, mdt) in self.image_data
-        ]
-        qdrant_client.upsert(
-            collection_name=self.configs['qdrant_config']['image_collection_name'],
-            points=points
-        )
+        batch_size = self.configs['embedding_config']['image_batch_size']
+        for start in range(0, len(self.image_data), batch_size):
+            image_data = self.image_data[start:start + batch_size]
+            self.upsert_images(image_data, self.embed_image_data(image_data))
             
-    def process(self) -> None:
+    def add_section_titles(self, md_splits : List[Document]) -> None:
+        """Prepends the section title to each split. Modifies the Document object in place."""
+        for split in md_splits:
+            split.page_content = self.get_embedded_text(split)
 
-        # process markdown data
-        print("Processing markdown data...")
-        md_splits = self.split_md_data()
-        self.insert_paper_info(md_splits[0])
-        md_splits.pop(0) # Remove paper info from the list
-        print("Total Splits to insert: ", len(md_splits))
-        print("Creating Split Metadata...")
-        uuids = self.create_split_metadata(md_splits)
-        if self.configs['chunking_config']['add_section_titles']:
-            for split in md_splits:
-                if 'chapter' in split.metadata.keys() and self.configs['chunking_config']['add_section_titles']:
-                    split.page_content = f"## {split.metadata['chapter']}\n" + split.page_content
-        print("Inserting Documents into Vector Store...")
-        self.insert_texts_in_vs(md_splits, uuids)
-
-        # process image data
+    def process_images(self) -> None:
+        """Saves, embeds and inserts the image data into the Qdrant Vector Store."""
         print("Processing image data...")
         print("Saving Images...")
         img_paths = self.save_images()
         print("Creating Image Metadata...")
         self.create_image_metadata(img_paths)
-        self.insert_images_in_vs()
\ No newline at end of file
+        self.insert_images_in_vs()
+        if self.embedding_cache is not None:
+            self.embedding_cache.print_stats()
+
+    def run_text_stages(self, batches : Iterable[Tuple[List[Document], List[str]]], timings : StageTimings) -> None:
+        """Embeds batches of splits while the previous ones are upserted."""
+        run_stages(batches, [
+            ('embed texts', lambda batch: (*batch, self.embed_texts(batch[0]))),
+            ('upsert texts', lambda batch: self.upsert_texts(*batch))
+        ], timings, self.configs['pipeline_config']['queue_size'])
+
+    def run_image_stages(self, batches : Iterable[ImageData], timings : StageTimings) -> None:
+        """Saves, embeds and upserts batches of images, each stage working on a different batch."""
+        def save_images(image_data : ImageData) -> ImageData:
+            self.create_image_metadata(self.save_images(image_data), image_data)
+            return image_data
+
+        run_stages(batches, [
+            ('save images', save_images),
+            ('embed images', lambda image_data: (image_data, self.embed_image_data(image_data))),
+            ('upsert images', lambda batch: self.upsert_images(*batch))
+        ], timings, self.configs['pipeline_config']['queue_size'])
+
+    def process(self) -> None:
+        """
+        Processes the markdown and image data as two concurrent branches of pipelined stages.
+        The text branch embeds batches of splits while the previous ones are upserted, and runs
+        alongside the image branch, so waiting on the embedding server overlaps the image work.
+        """
+        emb_config = self.configs['embedding_config']
+        timings = StageTimings()
+
+        def split_texts() -> Iterator[Tuple[List[Document], List[str]]]:
+            with timings.measure('split'):
+                print("Processing markdown data...")
+                self.save_markdown()
+                md_splits = self.split_md_data()
+                self.insert_paper_info(md_splits[0])
+                md_splits.pop(0) # Remove paper info from the list
+                print("Total Splits to insert: ", len(md_splits))
+                uuids = self.create_split_metadata(md_splits)
+                self.add_section_titles(md_splits)
+            # every batch keeps all embedding requests in flight
+            batch_size = emb_config['batch_size'] * emb_config['max_concurrent_requests']
+            for start in range(0, len(md_splits), batch_size):
+                yield md_splits[start:start + batch_size], uuids[start:start + batch_size]
+
+        def process_images() -> None:
+            print("Processing image data...")
+            batch_size = emb_config['image_batch_size']
+            image_batches = [self.image_data[i:i + batch_size] for i in range(0, len(self.image_data), batch_size)]
+            self.run_image_stages(image_batches, timings)
+
+        start = time.perf_counter()
+        run_branches({'text': lambda: self.run_text_stages(split_texts(), timings), 'image': process_images}, timings)
+        timings.report(time.perf_counter() - start)
+        if self.embedding_cache is not None:
+            self.embedding_cache.print_stats()
+
+    def process_stream(self, fragments : Iterable[Tuple[str, ImageData]]) -> None:
+        """
+        Processes the fragments yielded by a StreamingScraper as they arrive, with the same two concurrent
+        branches as process: the text branch chunks, embeds and upserts the markdown of each fragment,
+        while the image branch saves, embeds and upserts the figures handed over by the text branch.
+        Every fragment holds complete sections, so it is chunked and embedded on its own.
+        The last split of each fragment is held back until the next one arrives, to link it to its next split.
+        """
+        emb_config = self.configs['embedding_config']
+        timings = StageTimings()
+        image_queue : "queue.Queue[Optional[ImageData]]" = queue.Queue() # unbounded, the scraper never waits on images
+        total_splits = 0
+
+        def read_fragments() -> Iterator[str]:
+            """Yields the markdown of every fragment, handing its images over to the image branch."""
+            fragments_iter = iter(fragments)
+            while True:
+                with timings.measure('scrape'):
+                    item = next(fragments_iter, None)
+                if item is None:
+                    return
+                fragment, fragment_images = item
+                self.md_data += fragment
+                self.image_data.extend(fragment_images)
+                if fragment_images:
+                    image_queue.put(fragment_images)
+                yield fragment
+
+        def split_texts() -> Iterator[Tuple[List[Document], List[str]]]:
+            nonlocal total_splits
+            paper_info_inserted = False
+            pending : Optional[Tuple[Document, str]] = None # last split and its uuid
+            for fragment in read_fragments():
+                if not fragment.strip():
+                    continue
+                with timings.measure('split'):
+                    texts = self.markdown_splitter.split_text(fragment)
+                    if not paper_info_inserted:
+                        self.insert_paper_info(texts.pop(0))
+                        paper_info_inserted = True
+                    md_splits = self.token_splitter.split_documents(texts)
+                    if not md_splits:
+                        continue
+                    uuids = self.create_split_metadata(md_splits)
+                    self.add_section_titles(md_splits)
+                    if pending is not None:
+                        md_splits[0].metadata['prev_id'] = pending[1]
+                        pending[0].metadata['next_id'] = uuids[0]
+                        md_splits.insert(0, pending[0])
+                        uuids.insert(0, pending[1])
+                    pending = (md_splits.pop(), uuids.pop())
+                if md_splits:
+                    total_splits += len(md_splits)
+                    yield md_splits, uuids
+            if pending is not None:
+                total_splits += 1
+                yield [pending[0]], [pending[1]]
+            with timings.measure('split'):
+                self.save_markdown()
+
+        def process_texts() -> None:
+            try:
+                self.run_text_stages(split_texts(), timings)
+            finally:
+                image_queue.put(None) # no more images, also when the text branch failed
+
+        def image_batches() -> Iterator[ImageData]:
+            batch_size = emb_config['image_batch_size']
+            batch : ImageData = []
+            while (images := image_queue.get()) is not None:
+                batch.extend(images)
+                while len(batch) >= batch_size:
+                    yield batch[:batch_size]
+                    batch = batch[batch_size:]
+            if batch:
+                yield batch
+
+        print("Processing markdown stream...")
+        start = time.perf_counter()
+        run_branches({'text': process_texts, 'image': lambda: self.run_image_stages(image_batches(), timings)}, timings)
+        print("Total Splits inserted: ", total_splits)
+        timings.report(time.perf_counter() - start)
+        if self.embedding_cache is not None:
+            self.embedding_cache.print_stats()
+
+    def get_text_points(self) -> Dict[str, Dict[str, Any]]:
+        """Returns the payload of every text point of the paper, by id."""
+        qdrant_client : QdrantClient = self.text_vs.client
+        paper_filter = models.Filter(must=[
+            models.FieldCondition(key="metadata.paper_id", match=models.MatchValue(value=self.paper_id))
+        ])
+        points = {}
+        offset = None
+        while True:
+            records, offset = qdrant_client.scroll(
+                collection_name=self.configs['qdrant_config']['text_collection_name'],
+                scroll_filter=paper_filter,
+                limit=256,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
+            )
+            points.update((str(record.id), record.payload) for record in records)
+            if offset is None:
+                return points
+
+    def reindex(self) -> Dict[str, int]:
+        """
+        Re-chunks the stored markdown of the paper with the current settings and updates its text points.
+        Only new chunks are embedded and upserted. Chunks whose neighbours changed only get their payload
+        updated, and points of chunks that no longer exist are deleted.
+        Returns:
+            Dict[str, int]: Number of added, updated, deleted and unchanged chunks.
+        """
+        md_splits = self.split_md_data()[1:] # paper info does not change
+        uuids = self.create_split_metadata(md_splits)
+        self.add_section_titles(md_splits)
+        existing = self.get_text_points()
+        collection_name = self.configs['qdrant_config']['text_collection_name']
+        qdrant_client : QdrantClient = self.text_vs.client
+
+        stale = list(existing.keys() - set(uuids))
+        if stale:
+            with self.upsert_lock:
+                qdrant_client.delete(collection_name=collection_name, points_selector=models.PointIdsList(points=stale))
+        added = [i for i, uuid in enumerate(uuids) if uuid not in existing]
+        if added:
+            self.insert_texts_in_vs([md_splits[i] for i in added], [uuids[i] for i in added])
+        updated = 0
+        for uuid, split in zip(uuids, md_splits):
+            payload = {'metadata': split.metadata, 'page_content': split.page_content}
+            if uuid in existing and existing[uuid] != payload: # e.g. new prev_id or next_id
+                with self.upsert_lock:
+                    qdrant_client.overwrite_payload(collection_name=collection_name, payload=payload, points=[uuid])
+                updated += 1
+        return {
+            'added': len(added),
+            'updated': updated,
+            'deleted': len(stale),
+            'unchanged': len(uuids) - len(added) - updated
+        }
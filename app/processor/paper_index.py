@@ -0,0 +1,176 @@
+from qdrant_client import QdrantClient, models
+from langchain_core.documents import Document
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import threading
+import time
+import sys
+
+
+def estimate_size(obj : Any) -> int:
+    """Returns an estimate of the memory used by a payload: the size of its strings, numbers and containers."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(key) + estimate_size(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(estimate_size(item) for item in obj)
+    return size
+
+
+class PaperPartition:
+    """Points of a single paper: a contiguous matrix of normalized vectors and their payloads."""
+
+    def __init__(self, vectors : List[List[float]], payloads : List[Dict[str, Any]]):
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2: # paper without points
+            matrix = matrix.reshape(len(payloads), 0)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / np.maximum(norms, 1e-12)
+        self.payloads = payloads
+        self.fig_ref_ids = [set(payload.get('metadata', {}).get('fig_ref_ids', [])) for payload in payloads]
+        self.payload_nbytes = sum(estimate_size(payload) for payload in payloads) \
+            + sum(estimate_size(ids) for ids in self.fig_ref_ids)
+        self.loaded_at = time.monotonic()
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the vectors and the payloads kept for the search results."""
+        return self.matrix.nbytes + self.payload_nbytes
+
+    def top_k(self, query : np.ndarray, k : int, fig_ref_id : Optional[str] = None) -> List[Tuple[int, float]]:
+        """Returns the (row, cosine similarity) of the k rows most similar to the normalized query."""
+        if not self.payloads:
+            return []
+        scores = self.matrix @ query
+        if fig_ref_id is not None:
+            mask = np.fromiter((fig_ref_id in ids for ids in self.fig_ref_ids), dtype=bool, count=len(self.fig_ref_ids))
+            scores = np.where(mask, scores, -np.inf)
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        rows = np.argpartition(-scores, k - 1)[:k]
+        rows = rows[np.argsort(-scores[rows])]
+        return [(int(row), float(scores[row])) for row in rows]
+
+
+class PaperIndex:
+    """
+    In-process index of a Qdrant collection, partitioned by paper. The points of a paper are loaded the
+    first time it is searched, and the least recently used papers are dropped when the partitions,
+    vectors and payloads, exceed `max_memory_mb`. Loading a paper only blocks the searches of that paper.
+    Partitions older than `ttl` seconds are loaded again, so changes made by another process
+    (make ingest, make reindex, make cleardb) are picked up. A ttl of 0 keeps them until evicted.
+    Searching a paper is an exact cosine top-k over its own points only,
+    so query latency does not grow with the number of papers in the collection.
+    """
+
+    def __init__(self, client : QdrantClient, collection_name : str, max_memory_mb : float, ttl : float = 0):
+        self.client = client
+        self.collection_name = collection_name
+        self.max_bytes = max_memory_mb * 2**20
+        self.ttl = ttl
+        self._partitions : "OrderedDict[str, PaperPartition]" = OrderedDict()
+        self._lock = threading.Lock() # guards the partitions, never held while reading from qdrant
+        self._loading_locks : Dict[str, threading.Lock] = {}
+        self._generation = 0 # incremented by invalidate, partitions loaded across an invalidation are not kept
+
+    def load_partition(self, paper_id : str) -> PaperPartition:
+        """Reads every point of the paper from the collection."""
+        paper_filter = models.Filter(must=[
+            models.FieldCondition(key="metadata.paper_id", match=models.MatchValue(value=paper_id))
+        ])
+        vectors, payloads = [], []
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=paper_filter,
+                limit=256,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
+            )
+            for record in records:
+                vectors.append(record.vector)
+                payloads.append(record.payload)
+            if offset is None:
+                return PaperPartition(vectors, payloads)
+
+    def is_expired(self, partition : PaperPartition) -> bool:
+        """Returns True if the partition was loaded more than ttl seconds ago."""
+        return self.ttl > 0 and time.monotonic() - partition.loaded_at > self.ttl
+
+    def get_partition(self, paper_id : str) -> PaperPartition:
+        """Returns the partition of the paper, loading it and evicting the least recently used ones if needed."""
+        with self._lock:
+            if paper_id in self._partitions and self.is_expired(self._partitions[paper_id]):
+                del self._partitions[paper_id]
+            if paper_id in self._partitions:
+                self._partitions.move_to_end(paper_id)
+                return self._partitions[paper_id]
+            loading_lock = self._loading_locks.setdefault(paper_id, threading.Lock())
+        with loading_lock: # concurrent searches of the same paper wait for a single load
+            with self._lock:
+                if paper_id in self._partitions: # loaded while we waited
+                    self._partitions.move_to_end(paper_id)
+                    return self._partitions[paper_id]
+                generation = self._generation
+            try:
+                partition = self.load_partition(paper_id)
+            except BaseException:
+                with self._lock:
+                    self._loading_locks.pop(paper_id, None)
+                raise
+            with self._lock:
+                self._loading_locks.pop(paper_id, None)
+                if generation != self._generation: # points changed during the load, do not keep them
+                    return partition
+                self._partitions[paper_id] = partition
+                used = sum(p.nbytes for p in self._partitions.values())
+                while used > self.max_bytes and len(self._partitions) > 1: # always keep the paper being searched
+                    _, evicted = self._partitions.popitem(last=False)
+                    used -= evicted.nbytes
+            return partition
+
+    def invalidate(self, paper_id : Optional[str] = None) -> None:
+        """Drops the partition of the paper, or every partition if paper_id is None, after its points changed."""
+        with self._lock:
+            self._generation += 1
+            if paper_id is None:
+                self._partitions.clear()
+            else:
+                self._partitions.pop(paper_id, None)
+
+    def similarity_search_with_score(self, paper_id : str, query_vector : List[float], k : int,
+                                     fig_ref_id : Optional[str] = None) -> List[Tuple[Document, float]]:
+        """
+        Returns the k documents of the paper most similar to the query vector, with their cosine similarity.
+        If fig_ref_id is set, only documents referencing that figure are searched.
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        partition = self.get_partition(paper_id)
+        return [
+            (Document(
+                page_content=partition.payloads[row].get('page_content', ''),
+                metadata=partition.payloads[row].get('metadata', {})
+            ), score)
+            for row, score in partition.top_k(query, k, fig_ref_id)
+        ]
+
+    def similarity_search(self, paper_id : str, query_vector : List[float], k : int,
+                          fig_ref_id : Optional[str] = None) -> List[Document]:
+        """Returns the k documents of the paper most similar to the query vector."""
+        return [doc for doc, _ in self.similarity_search_with_score(paper_id, query_vector, k, fig_ref_id)]
+
+    def similarity_search_with_relevance_scores(self, paper_id : str, query_vector : List[float], k : int,
+                                                score_threshold : Optional[float] = None) -> List[Tuple[Document, float]]:
+        """
+        Returns the k documents of the paper most similar to the query vector, with the relevance score
+        QdrantVectorStore gives to cosine similarities, (similarity + 1) / 2, above score_threshold.
+        """
+        docs = [(doc, (score + 1.0) / 2.0) for doc, score in self.similarity_search_with_score(paper_id, query_vector, k)]
+        if score_threshold is not None:
+            docs = [(doc, score) for doc, score in docs if score >= score_threshold]
+        return docs
@@ -0,0 +1,132 @@
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+import threading
+import queue
+import time
+
+_DONE = object() # marks the end of a stage's input
+
+
+class StageTimings:
+    """Thread-safe accumulator of the time spent working in each pipeline stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages : Dict[str, float] = {}
+        self.branches : Dict[str, float] = {}
+
+    @contextmanager
+    def measure(self, stage : str) -> Iterator[None]:
+        """Adds the time spent in the with block to the stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+
+    def report(self, wall_time : float) -> None:
+        """Prints the time of every stage and branch, and the branch on the critical path."""
+        print(f"Pipeline finished in {wall_time:.2f}s")
+        for stage, elapsed in self.stages.items():
+            print(f"  stage {stage:<16}: {elapsed:8.2f}s")
+        if self.branches:
+            critical_branch = max(self.branches, key=self.branches.get)
+            for branch, elapsed in self.branches.items():
+                print(f"  branch {branch:<15}: {elapsed:8.2f}s")
+            serial_time = sum(self.stages.values())
+            print(f"  critical path: {critical_branch} branch ({self.branches[critical_branch]:.2f}s), "
+                  f"{max(serial_time - wall_time, 0.0):.2f}s saved by overlapping stages")
+
+
+def run_stages(source : Iterable[Any],
+               stages : List[Tuple[str, Callable[[Any], Any]]],
+               timings : StageTimings,
+               maxsize : int = 2) -> None:
+    """
+    Runs each stage in its own thread, feeding it the outputs of the previous one through a bounded queue.
+    The items of source go through every stage in order, the outputs of the last stage are discarded.
+    If a stage fails, the other stages are stopped and the error is raised.
+    Args:
+        source (Iterable[Any]): Input items of the first stage.
+        stages (List[Tuple[str, Callable[[Any], Any]]]): (name, function) of every stage.
+        timings (StageTimings): Collects the time spent in every stage.
+        maxsize (int): Max number of items waiting between two stages.
+    """
+    queues = [queue.Queue(maxsize=max(maxsize, 1)) for _ in stages]
+    stop = threading.Event()
+    errors : List[BaseException] = []
+
+    def put(q : queue.Queue, item : Any) -> bool:
+        """Puts the item in the queue, giving up if the pipeline is stopped."""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q : queue.Queue) -> Any:
+        """Gets the next item from the queue, _DONE if the pipeline is stopped."""
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def run_stage(idx : int) -> None:
+        name, fn = stages[idx]
+        out_q = queues[idx + 1] if idx + 1 < len(stages) else None
+        try:
+            while (item := get(queues[idx])) is not _DONE:
+                with timings.measure(name):
+                    result = fn(item)
+                if out_q is not None and not put(out_q, result):
+                    return
+            if out_q is not None:
+                put(out_q, _DONE)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=run_stage, args=(i,), daemon=True) for i in range(len(stages))]
+    for thread in threads:
+        thread.start()
+    try:
+        for item in source:
+            if not put(queues[0], item):
+                break
+        put(queues[0], _DONE)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+
+def run_branches(branches : Dict[str, Callable[[], None]], timings : StageTimings) -> None:
+    """Runs the branches concurrently, recording the wall time of each one, and raises the first error."""
+    errors : List[BaseException] = []
+
+    def run_branch(name : str, fn : Callable[[], None]) -> None:
+        start = time.perf_counter()
+        try:
+            fn()
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            timings.branches[name] = time.perf_counter() - start
+
+    threads = [threading.Thread(target=run_branch, args=branch, daemon=True) for branch in branches.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
@@ -1,4 +1,4 @@
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Iterable, Tuple
 from app.config_loader import ConfigLoader
 from app.scraper.scraper import ImageData
 
@@ -23,4 +23,11 @@ class Processor:
 
     def process(self) -> None:
         """Process documents."""
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def process_stream(self, fragments: Iterable[Tuple[str, ImageData]]) -> None:
+        """Process the fragments yielded by a StreamingScraper. By default they are collected and processed at once."""
+        for fragment, fragment_images in fragments:
+            self.md_data += fragment
+            self.image_data.extend(fragment_images)
+        self.process()
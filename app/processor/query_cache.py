@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+import threading
+import time
+
+
+def normalize_query(query : str) -> str:
+    """Returns the query lowercased with its whitespace collapsed, so trivially different queries share entries."""
+    return ' '.join(query.lower().split())
+
+
+class QueryCache:
+    """
+    In-memory LRU cache of query embeddings and retrieval results, shared by every chat session.
+    Keys are tuples whose first element is the paper_id the entry depends on (None for query embeddings),
+    so the entries of a paper can be dropped when it is re-ingested or deleted.
+    Entries older than `ttl` seconds are treated as missing, a ttl of 0 keeps them until evicted.
+    Every invalidation bumps the generation of the paper, so results computed before it can be refused.
+    """
+
+    def __init__(self, max_entries : int, ttl : float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries : "OrderedDict[Tuple[Hashable, ...], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0 # bumped when every entry is invalidated
+        self._paper_generations : Dict[Optional[str], int] = {}
+
+    def get(self, key : Tuple[Hashable, ...]) -> Optional[Any]:
+        """Returns the cached value, None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if self.ttl > 0 and time.monotonic() - created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def get_generation(self, paper_id : Optional[str]) -> Tuple[int, int]:
+        """Returns the generation of the paper, to pass to put along with the value computed after this call."""
+        with self._lock:
+            return self._generation, self._paper_generations.get(paper_id, 0)
+
+    def put(self, key : Tuple[Hashable, ...], value : Any, generation : Optional[Tuple[int, int]] = None) -> None:
+        """
+        Caches the value, evicting the least recently used entries if the cache is full.
+        If generation is set and the paper of the key was invalidated since, the value is not cached.
+        """
+        with self._lock:
+            if generation is not None and generation != (self._generation, self._paper_generations.get(key[0], 0)):
+                return
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, paper_id : Optional[str] = None) -> None:
+        """Drops the entries of the paper, or every entry if paper_id is None, after its points changed."""
+        with self._lock:
+            if paper_id is None:
+                self._generation += 1
+                self._entries.clear()
+                return
+            self._paper_generations[paper_id] = self._paper_generations.get(paper_id, 0) + 1
+            for key in [key for key in self._entries if key[0] == paper_id]:
+                del self._entries[key]
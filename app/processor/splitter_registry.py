@@ -0,0 +1,89 @@
+from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
+from transformers import AutoTokenizer, PreTrainedTokenizer, PreTrainedTokenizerFast
+from app.processor.token_chunker import TokenChunker
+from typing import Dict, List, Tuple
+import threading
+import time
+
+
+class SplitterRegistry:
+    """
+    Singleton registry of the tokenizers and text splitters shared by every processor of the process.
+    Each tokenizer is loaded once and each splitter is built once per configuration, so only the first
+    ingestion pays the tokenizer startup cost. Splitters keep no state between calls and can be shared.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = super(SplitterRegistry, cls).__new__(cls)
+                cls._instance._init_registry()
+        return cls._instance
+
+    def _init_registry(self) -> None:
+        """Initializes an empty registry."""
+        self._lock = threading.Lock()
+        self._tokenizers : Dict[str, PreTrainedTokenizer|PreTrainedTokenizerFast] = {}
+        self._markdown_splitters : Dict[Tuple[Tuple[str, str], ...], MarkdownHeaderTextSplitter] = {}
+        self._token_splitters : Dict[Tuple[str, int, int], RecursiveCharacterTextSplitter] = {}
+        self._token_chunkers : Dict[Tuple[str, int, int], TokenChunker] = {}
+
+    @staticmethod
+    def load_tokenizer_model(model_name : str) -> PreTrainedTokenizer|PreTrainedTokenizerFast:
+        """
+        Loads the tokenizer of the Embedding Model used by the Embedding Server.
+        The local copy is used if there is one, so the hub is only contacted on the first run.
+        """
+        try:
+            return AutoTokenizer.from_pretrained(model_name, local_files_only=True)
+        except Exception:
+            pass
+        try:
+            token = AutoTokenizer.from_pretrained(model_name)
+        except Exception as e:
+            print(f"Error loading tokenizer: {e}. Trying to download...")
+            token = AutoTokenizer.from_pretrained(model_name, force_download=True)
+        return token
+
+    def get_tokenizer(self, model_name : str) -> PreTrainedTokenizer|PreTrainedTokenizerFast:
+        """Returns the tokenizer of the model, loading it on first use."""
+        with self._lock:
+            if model_name not in self._tokenizers:
+                start = time.perf_counter()
+                self._tokenizers[model_name] = self.load_tokenizer_model(model_name)
+                print(f"Loaded tokenizer {model_name} in {time.perf_counter() - start:.2f}s")
+            return self._tokenizers[model_name]
+
+    def get_markdown_splitter(self, headers : List[Tuple[str, str]]) -> MarkdownHeaderTextSplitter:
+        """Returns the markdown splitter of the headers, building it on first use."""
+        key = tuple(headers)
+        with self._lock:
+            if key not in self._markdown_splitters:
+                self._markdown_splitters[key] = MarkdownHeaderTextSplitter(list(headers))
+            return self._markdown_splitters[key]
+
+    def get_token_splitter(self, model_name : str, chunk_size : int, chunk_overlap : int) -> RecursiveCharacterTextSplitter:
+        """Returns the sentence splitter measuring chunks with the tokenizer of the model, building it on first use."""
+        tokenizer = self.get_tokenizer(model_name)
+        key = (model_name, chunk_size, chunk_overlap)
+        with self._lock:
+            if key not in self._token_splitters:
+                self._token_splitters[key] = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+                    separators=['. '], # split by sentences
+                    keep_separator=True,
+                    tokenizer=tokenizer,
+                    chunk_size=chunk_size,
+                    chunk_overlap=chunk_overlap
+                )
+            return self._token_splitters[key]
+
+    def get_token_chunker(self, model_name : str, chunk_size : int, chunk_overlap : int) -> TokenChunker:
+        """Returns the single-pass chunker measuring chunks with the tokenizer of the model, building it on first use."""
+        tokenizer = self.get_tokenizer(model_name)
+        key = (model_name, chunk_size, chunk_overlap)
+        with self._lock:
+            if key not in self._token_chunkers:
+                self._token_chunkers[key] = TokenChunker(tokenizer, chunk_size, chunk_overlap)
+            return self._token_chunkers[key]
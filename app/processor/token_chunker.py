@@ -0,0 +1,73 @@
+from langchain_core.documents import Document
+from transformers import PreTrainedTokenizerFast
+from typing import Iterable, List, Tuple
+from bisect import bisect_left
+import re
+
+
+class TokenChunker:
+    """
+    Splits texts in chunks of at most `chunk_size` tokens, cutting on sentence boundaries, with about
+    `chunk_overlap` tokens of overlap between consecutive chunks.
+    Every text is tokenized once: the offset mapping of the fast tokenizer gives the number of tokens
+    of every sentence, so chunks are measured without tokenizing them again.
+    Sentences longer than `chunk_size` are cut on token boundaries.
+    """
+
+    def __init__(self, tokenizer : PreTrainedTokenizerFast, chunk_size : int, chunk_overlap : int, separator : str = '. '):
+        if not tokenizer.is_fast:
+            raise ValueError("TokenChunker needs a fast tokenizer to get the offset mapping")
+        self.tokenizer = tokenizer
+        self.chunk_size = max(chunk_size, 1)
+        self.chunk_overlap = min(max(chunk_overlap, 0), self.chunk_size - 1)
+        self.separator = re.compile(re.escape(separator))
+
+    def get_token_starts(self, text : str) -> List[int]:
+        """Tokenizes the text once and returns the character offset where every token starts."""
+        encoding = self.tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True, return_attention_mask=False, verbose=False
+        )
+        return [start for start, _ in encoding['offset_mapping']]
+
+    def get_sentences(self, text : str, token_starts : List[int]) -> List[Tuple[int, int, int]]:
+        """
+        Returns the (start, end, number of tokens) of every sentence of the text. Sentences end after the separator.
+        A token belongs to the sentence it starts in, so the number of tokens of consecutive sentences adds up.
+        Sentences longer than chunk_size are cut every chunk_size tokens.
+        """
+        bounds = [0] + [match.end() for match in self.separator.finditer(text)] + [len(text)]
+        sentences = []
+        for start, end in zip(bounds, bounds[1:]):
+            first_token, last_token = bisect_left(token_starts, start), bisect_left(token_starts, end)
+            for piece_token in range(first_token, last_token, self.chunk_size):
+                piece_end_token = min(piece_token + self.chunk_size, last_token)
+                piece_start = start if piece_token == first_token else token_starts[piece_token]
+                piece_end = end if piece_end_token == last_token else token_starts[piece_end_token]
+                sentences.append((piece_start, piece_end, piece_end_token - piece_token))
+        return sentences
+
+    def split_text(self, text : str) -> List[str]:
+        """Splits the text in chunks, merging consecutive sentences like RecursiveCharacterTextSplitter."""
+        sentences = self.get_sentences(text, self.get_token_starts(text))
+        chunks = []
+        first = 0 # first sentence of the current chunk
+        total = 0 # tokens of the current chunk
+        for i, (_, _, num_tokens) in enumerate(sentences):
+            if total + num_tokens > self.chunk_size and i > first:
+                chunks.append(text[sentences[first][0]:sentences[i - 1][1]])
+                # keep the last sentences as overlap, as long as the next sentence still fits
+                while total > self.chunk_overlap or (total + num_tokens > self.chunk_size and total > 0):
+                    total -= sentences[first][2]
+                    first += 1
+            total += num_tokens
+        if first < len(sentences):
+            chunks.append(text[sentences[first][0]:sentences[-1][1]])
+        return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+    def split_documents(self, documents : Iterable[Document]) -> List[Document]:
+        """Splits the documents in chunks, copying the metadata of each document to its chunks."""
+        return [
+            Document(page_content=chunk, metadata=dict(doc.metadata))
+            for doc in documents
+            for chunk in self.split_text(doc.page_content)
+        ]
@@ -84,7 +84,7 @@ multimodal_rag_chat_prompt = ChatPromptTemplate.from_messages([
     ("user", [
         {
             "type": "image_url",
-            "image_url": {"url": "data:image/png;base64,{image_data}"},
+            "image_url": {"url": "data:{image_mime};base64,{image_data}"},
         },
         {
             "type": "text",
@@ -0,0 +1,143 @@
+from app.config_loader import ConfigLoader
+from app.scraper.scraper import Scraper
+from app.processor.embedding_cache import CachedEmbeddings, get_embedding_cache
+from app.processor.paper_index import PaperIndex
+from app.processor.query_cache import QueryCache
+from app.scripts.qdrant_helper import get_qdrant_client
+from app.prompts import rewrite_chat_prompt, rewrite_parser, rag_chat_prompt, multimodal_rag_chat_prompt
+
+from typing import Any, Callable, Dict, Optional, Tuple, TYPE_CHECKING
+import threading
+import asyncio
+import time
+
+from qdrant_client import QdrantClient
+from langchain_core.embeddings import Embeddings
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable
+from langchain_ollama import OllamaEmbeddings
+from langchain_qdrant import QdrantVectorStore
+
+if TYPE_CHECKING:
+    from langchain_community.chat_models import ChatLiteLLM
+
+
+class ResourceRegistry:
+    """
+    Singleton registry of the heavy resources shared by every chat session of the process:
+    qdrant client, embeddings, vector stores, image model, scraper, LLM chains, paper indexes and query cache.
+    Every resource is created once, on first use, and then returned to every session.
+    Creation is serialized per resource, so concurrent sessions never load the same resource twice.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = super(ResourceRegistry, cls).__new__(cls)
+                cls._instance._init_registry()
+        return cls._instance
+
+    def _init_registry(self) -> None:
+        """Initializes an empty registry."""
+        self.configs = ConfigLoader().get_config()
+        self._resources : Dict[str, Any] = {}
+        self._locks : Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def get(self, name : str, factory : Callable[[], Any]) -> Any:
+        """Returns the resource, creating it with factory if it does not exist yet."""
+        if name in self._resources:
+            return self._resources[name]
+        with self._locks_lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._resources: # another session may have created it while we waited
+                start = time.perf_counter()
+                self._resources[name] = factory()
+                print(f"Loaded shared {name} in {time.perf_counter() - start:.2f}s")
+        return self._resources[name]
+
+    def get_qdrant_client(self) -> QdrantClient:
+        return self.get("qdrant_client", get_qdrant_client)
+
+    def get_text_embeddings(self) -> Embeddings:
+        """Returns the text embeddings, looking queries up in the embedding cache if it is enabled."""
+        def create() -> Embeddings:
+            model = self.configs['embedding_config']['model']
+            embeddings = OllamaEmbeddings(model=model)
+            embedding_cache = get_embedding_cache()
+            if embedding_cache is not None: # queries asked again are not embedded again
+                embeddings = CachedEmbeddings(embeddings, model, embedding_cache)
+            return embeddings
+        return self.get("text_embeddings", create)
+
+    def get_vector_store(self, collection_name : str) -> QdrantVectorStore:
+        return self.get(f"vector_store:{collection_name}", lambda: QdrantVectorStore(
+            client=self.get_qdrant_client(),
+            collection_name=collection_name,
+            embedding=self.get_text_embeddings()
+        ))
+
+    def get_paper_index(self, collection_name : str) -> Optional[PaperIndex]:
+        """Returns the paper index of the collection, None if use_paper_index is not set."""
+        qdrant_config = self.configs['qdrant_config']
+        if not qdrant_config['use_paper_index']:
+            return None
+        return self.get(f"paper_index:{collection_name}", lambda: PaperIndex(
+            self.get_qdrant_client(), collection_name, qdrant_config['paper_index_memory_mb'],
+            qdrant_config['paper_index_ttl']
+        ))
+
+    def get_query_cache(self) -> Optional[QueryCache]:
+        """Returns the cache of query embeddings and retrieval results, None if use_query_cache is not set."""
+        cache_config = self.configs['query_cache_config']
+        if not cache_config['use_query_cache']:
+            return None
+        return self.get("query_cache", lambda: QueryCache(
+            cache_config['query_cache_max_entries'], cache_config['query_cache_ttl']
+        ))
+
+    def get_image_model(self) -> Tuple[Any, Any]:
+        """Returns the image processor and the image embedding model."""
+        from transformers import AutoModel, AutoImageProcessor # vision only, imported on first use
+        model_name = self.configs['embedding_config']['image_model']
+        img_proc = self.get("image_processor", lambda: AutoImageProcessor.from_pretrained(model_name))
+        img_emb = self.get("image_model", lambda: AutoModel.from_pretrained(model_name, trust_remote_code=True))
+        return img_proc, img_emb
+
+    def get_scraper(self) -> Scraper:
+        from app.scraper.auto_scraper import create_scraper # ingestion only, imported on first use
+        return self.get("scraper", create_scraper)
+
+    def get_chat_llm(self) -> "ChatLiteLLM":
+        def create() -> "ChatLiteLLM":
+            from langchain_community.chat_models import ChatLiteLLM # pulls in litellm, imported when the first session starts
+            agent_config = self.configs['agent_config']
+            return ChatLiteLLM(
+                model=agent_config['model_name'],
+                temperature=agent_config['temperature'],
+                api_base=agent_config['api_base'] if agent_config['api_base'] != "" else None,
+            )
+        return self.get("chat_llm", create)
+
+    def get_chains(self) -> Dict[str, Runnable]:
+        """Returns the rewrite, rag and multimodal rag chains. Chains keep no state, so sessions share them."""
+        def create() -> Dict[str, Runnable]:
+            chat_llm = self.get_chat_llm()
+            return {
+                'rewrite_chain': rewrite_chat_prompt | chat_llm | rewrite_parser,
+                'rag_chain': rag_chat_prompt | chat_llm | StrOutputParser(),
+                'multimodal_rag_chain': multimodal_rag_chat_prompt | chat_llm | StrOutputParser(),
+            }
+        return self.get("chains", create)
+
+    def get_backend_limit(self, backend : str) -> asyncio.Semaphore:
+        """
+        Returns the semaphore bounding the concurrent requests of all sessions to the backend:
+        llm, embedding or vector_search. Limits are set in concurrency_config.
+        """
+        return self.get(f"limit:{backend}", lambda: asyncio.Semaphore(
+            max(self.configs['concurrency_config'][f'{backend}_max_concurrency'], 1)
+        ))
@@ -0,0 +1,45 @@
+from app.scraper.scraper import StreamingScraper, ImageData
+from app.scraper.papermage_scraper import PapermageScraper
+from app.scraper.pymupdf_scraper import PymupdfScraper
+from app.config_loader import ConfigLoader
+
+from typing import Tuple, Iterator
+
+
+class AutoScraper(StreamingScraper):
+    """
+    Scraper that probes each document and uses the fast PymupdfScraper when the document has a
+    clean text layer, falling back to the layout analysis of PapermageScraper otherwise.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.fast_scraper = PymupdfScraper()
+        self.layout_scraper = PapermageScraper()
+
+    def select_scraper(self, document_path : str) -> StreamingScraper:
+        """Returns the scraper to use for the document."""
+        try:
+            use_fast_path = self.fast_scraper.can_process(document_path)
+        except Exception as e:
+            print(f"Error probing document: {e}. Falling back to layout analysis.")
+            use_fast_path = False
+        scraper = self.fast_scraper if use_fast_path else self.layout_scraper
+        print(f"Scraping document with {type(scraper).__name__}")
+        return scraper
+
+    def stream_document(self, document_path : str) -> Iterator[Tuple[str, ImageData]]:
+        """Processes the document with the selected scraper."""
+        yield from self.select_scraper(document_path).stream_document(document_path)
+
+
+def create_scraper() -> StreamingScraper:
+    """Creates the scraper set in scraper_config: auto, papermage or pymupdf."""
+    scraper = ConfigLoader().get_config()['scraper_config']['scraper']
+    if scraper == 'auto':
+        return AutoScraper()
+    if scraper == 'papermage':
+        return PapermageScraper()
+    if scraper == 'pymupdf':
+        return PymupdfScraper()
+    raise ValueError(f"Unknown scraper: {scraper}")
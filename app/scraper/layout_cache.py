@@ -0,0 +1,43 @@
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+
+
+class LayoutCache:
+    """
+    On-disk cache of the intermediate output of a scraper, keyed by the hash of the document,
+    the version of the scraper that produced it and the settings the output depends on.
+    Bump the scraper version whenever the cached output would change, old entries are then simply ignored.
+    """
+
+    def __init__(self, cache_dir : str, version : int, settings : Optional[Dict[str, Any]] = None):
+        self.cache_dir = cache_dir
+        self.version = version
+        # changing any of the settings, e.g. the layout dpi, switches to other entries
+        self.settings_hash = hashlib.sha256(json.dumps(settings or {}, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_path(self, file_hash : str) -> str:
+        """Returns the path of the cache entry of the document."""
+        return os.path.join(self.cache_dir, f"{file_hash}_v{self.version}_{self.settings_hash}.json")
+
+    def load(self, file_hash : str) -> Optional[Dict[str, Any]]:
+        """Returns the cached layout of the document, None if it is not cached or unreadable."""
+        path = self.get_path(file_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading layout cache {path}: {e}")
+            return None
+
+    def save(self, file_hash : str, layout : Dict[str, Any]) -> None:
+        """Saves the layout of the document. The entry is written atomically."""
+        path = self.get_path(file_hash)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(layout, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,53 @@
+from app.scraper.page_renderer import pixmap_to_image
+from papermage.magelib import Image
+from PIL.Image import Image as PILImage
+from typing import List, Optional, Tuple
+import fitz
+
+
+class LazyPageSource:
+    """
+    Rasterizes the pages of a PDF document on demand at the given DPI.
+    Only the last rendered page is kept in memory.
+    """
+
+    def __init__(self, document_path : str, dpi : int):
+        self.pdf_doc = fitz.open(document_path)
+        self.dpi = dpi
+        self._cached_page : Optional[Tuple[int, PILImage]] = None
+
+    def render(self, page_num : int) -> PILImage:
+        """Returns the image of the page, rendering it only if it is not the cached one."""
+        if self._cached_page is None or self._cached_page[0] != page_num:
+            self._cached_page = None # release the previous page before rendering the next one
+            pix = self.pdf_doc[page_num].get_pixmap(dpi=self.dpi)
+            self._cached_page = (page_num, pixmap_to_image(pix))
+        return self._cached_page[1]
+
+    def get_images(self) -> List["LazyPageImage"]:
+        """Returns one lazy papermage Image per page."""
+        return [LazyPageImage(self, page_num) for page_num in range(len(self.pdf_doc))]
+
+    def release(self) -> None:
+        """Releases the cached page image."""
+        self._cached_page = None
+
+    def close(self) -> None:
+        """Releases the cached page image and closes the document."""
+        self.release()
+        self.pdf_doc.close()
+
+
+class LazyPageImage(Image):
+    """papermage Image whose PIL image is rendered by a LazyPageSource when accessed."""
+
+    __slots__ = ["_source", "_page_num"]
+
+    def __init__(self, source : LazyPageSource, page_num : int):
+        super().__init__()
+        self._source = source
+        self._page_num = page_num
+
+    @property
+    def pilimage(self) -> PILImage:
+        return self._source.render(self._page_num)
@@ -0,0 +1,59 @@
+from typing import Optional, Tuple
+from PIL import Image
+import fitz
+
+CLIP = 'clip'
+PAGE = 'page'
+
+
+def pixmap_to_image(pix : fitz.Pixmap) -> Image:
+    """Builds a PIL Image straight from the pixmap samples, without encoding it to PNG."""
+    mode = "RGBA" if pix.alpha else "RGB"
+    return Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+
+class PageRenderer:
+    """
+    Renders figure regions of a PDF document at a given zoom factor.
+    In `clip` mode only the figure region is rasterized, in `page` mode every page
+    is rasterized once and the last rendered page is reused for all of its figures.
+    """
+
+    def __init__(self, pdf_doc : fitz.Document, zoom_factor : float = 2, mode : str = CLIP):
+        if mode not in (CLIP, PAGE):
+            raise ValueError(f"Unknown render mode: {mode}")
+        self.pdf_doc = pdf_doc
+        self.zoom_factor = zoom_factor
+        self.mode = mode
+        self.matrix = fitz.Matrix(zoom_factor, zoom_factor)
+        self._cached_page : Optional[Tuple[int, Image]] = None
+
+    def render_page(self, page_num : int) -> Image:
+        """Returns the rendered page, rendering it only if it is not the cached one."""
+        if self._cached_page is None or self._cached_page[0] != page_num:
+            pix = self.pdf_doc[page_num].get_pixmap(matrix=self.matrix)
+            self._cached_page = (page_num, pixmap_to_image(pix))
+        return self._cached_page[1]
+
+    def page_size(self, page_num : int) -> Tuple[float, float]:
+        """Returns the width and height of the page in PDF points."""
+        rect = self.pdf_doc[page_num].rect
+        return rect.width, rect.height
+
+    def render_region(self, page_num : int, xy_coordinates : Tuple[float, float, float, float]) -> Image:
+        """
+        Renders the region of the page delimited by xy_coordinates.
+        Args:
+            page_num (int): Page number of the region.
+            xy_coordinates (Tuple[float, float, float, float]): (x1, y1, x2, y2) in PDF points.
+        Returns:
+            Image: Rendered region.
+        """
+        if self.mode == PAGE:
+            return self.render_page(page_num).crop([el*self.zoom_factor for el in xy_coordinates])
+        pix = self.pdf_doc[page_num].get_pixmap(matrix=self.matrix, clip=fitz.Rect(*xy_coordinates))
+        return pixmap_to_image(pix)
+
+    def clear(self) -> None:
+        """Releases the cached page render."""
+        self._cached_page = None
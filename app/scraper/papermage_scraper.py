@@ -1,27 +1,56 @@
-from app.scraper.scraper import Scraper, ImageData
+from app.scraper.scraper import StreamingScraper, ImageData
+from app.scraper.page_renderer import PageRenderer
+from app.scraper.spatial_index import PageBoxIndex
+from app.scraper.recipe_pool import RecipePool
+from app.scraper.layout_cache import LayoutCache
+from app.scraper.lazy_images import LazyPageSource
+from app.scripts.utils import hash_content, get_peak_rss_mb
+from app.config_loader import ConfigLoader
 
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, Any, Iterable, Iterator
 from papermage.magelib import Entity, Box, Document
 from papermage.recipes import CoreRecipe
 from PIL import Image
 import io
 import fitz
 import logging
+import time
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
 
-class PapermageScraper(Scraper):
+SCRAPER_VERSION = 1 # bump when the scraper output changes, invalidates the layout cache
+
+PageRows = List[Tuple[str, Entity]]
+# (row type, entity) tuples of a single page, see PapermageScraper.process_page
+
+class PapermageScraper(StreamingScraper):
 
     def __init__(self):
         super().__init__()
         self.WRAP_ROWS = True
         self.PARAGRAPH = 'par'
         self.SECTION = 'sec'
-        self.zoom_factor = 2
+        self.PRELIMINARY_TYPES = ['titles', 'authors', 'abstracts', 'keywords']
+        self.FILTER_TYPES = ['figures', 'tables', 'captions', 'equations', 'footers', 'footnotes', 'headers']
+        scraper_config = ConfigLoader().get_config()['scraper_config']
+        self.zoom_factor = scraper_config['zoom_factor']
+        self.figure_render_mode = scraper_config['figure_render_mode']
+        self.num_workers = scraper_config['num_workers']
+        self.lazy_rasterization = scraper_config['lazy_rasterization']
+        self.layout_cache = None
+        if scraper_config['use_layout_cache']:
+            # figures are rendered again from the cached boxes, only the layout analysis settings shape the entries
+            self.layout_cache = LayoutCache(os.path.join('app', 'storage', 'layout_cache'), SCRAPER_VERSION,
+                                            {'layout_dpi': scraper_config['layout_dpi']})
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.DEBUG)
-        #log via file
-        self.fh = logging.FileHandler('papermage_scraper.log')
-        self.fh.setLevel(logging.DEBUG)
-        self.logger.addHandler(self.fh)
+        #log via file, the logger is shared by every scraper instance so the handler is added only once
+        if not self.logger.handlers:
+            self.fh = logging.FileHandler('papermage_scraper.log')
+            self.fh.setLevel(logging.DEBUG)
+            self.logger.addHandler(self.fh)
 
     def concatenate_texts(self, layer : List[Entity], remove_newline_chars = True) -> str:
         """concatenate all text blocks in a layer."""
@@ -63,25 +92,26 @@ class PapermageScraper(Scraper):
         ext_ent.boxes = [new_box]
         return ext_ent
 
-    def check_box_intersections(self, row_box: Box, page: Entity, box_types: List[str]) -> bool:
+    def check_box_intersections(self, row_box: Box, page_index: PageBoxIndex, box_types: List[str]) -> bool:
         """Checks if row intersects with any of the specified box types in the page."""
-        for box_type in box_types:
-            if any([row_box.is_overlap(item.boxes[0]) for item in page.intersect_by_box(box_type)]):
-                return True
-        return False
+        return page_index.any_overlap(row_box, box_types)
 
-    def filter_preliminary_row(self, row : Entity, page : Entity) -> bool:
+    def filter_preliminary_row(self, row : Entity, page_index : PageBoxIndex) -> bool:
         """Returns True if row intersects Titles, Abstracts, Authors and keywords from the page."""
-        preliminary_types = ['titles', 'authors', 'abstracts', 'keywords']
-        return self.check_box_intersections(row.boxes[0], page, preliminary_types)
+        return self.check_box_intersections(row.boxes[0], page_index, self.PRELIMINARY_TYPES)
 
-    def filter_row(self, row : Entity, page : Entity) -> bool:
+    def filter_row(self, row : Entity, page_index : PageBoxIndex) -> bool:
         """Returns True if row intersects any figure, table or equation from the page."""
-        filter_types = ['figures', 'tables', 'captions', 'equations', 'footers', 'footnotes', 'headers']
-        return self.check_box_intersections(row.boxes[0], page, filter_types)
+        return self.check_box_intersections(row.boxes[0], page_index, self.FILTER_TYPES)
+
+    def build_page_index(self, page : Entity) -> PageBoxIndex:
+        """Builds the spatial index of the layers needed to filter the rows of the page."""
+        return PageBoxIndex(page, self.PRELIMINARY_TYPES + self.FILTER_TYPES + ['sections'])
 
-    def get_section(self, doc : Document, row : Entity) -> Optional[Entity]:
+    def get_section(self, doc : Document, row : Entity, page_index : Optional[PageBoxIndex] = None) -> Optional[Entity]:
         """Returns the section that intersects with the row, None Otherwise."""
+        if page_index is not None and all(box.page == page_index.page_num for box in row.boxes):
+            return page_index.first_intersection(row, 'sections')
         sections = doc.intersect_by_box(row, 'sections')
         return sections[0] if len(sections) > 0 else None
 
@@ -92,9 +122,16 @@ class PapermageScraper(Scraper):
         if not len(entities)>0: return None
         return self.concatenate_texts(entities)
 
-    def extract_image_from_box(self, pdf_doc : fitz.Document, fig : Entity, page : Entity, page_wdth : int, page_hght : int ) -> Image:
+    def extract_image_from_box(self, renderer : PageRenderer, fig : Entity) -> Image:
         """Extracts the Image from the page that intersects with the box."""
         page_num = fig.boxes[0].page
+        page_wdth, page_hght = renderer.page_size(page_num) # boxes are relative, the renderer works in PDF points
+        fig_box = fig.boxes[0].to_absolute(page_wdth, page_hght).xy_coordinates
+        return renderer.render_region(page_num, fig_box)
+
+    def extract_image_from_box_png(self, pdf_doc : fitz.Document, fig : Entity, page_wdth : int, page_hght : int) -> Image:
+        """Extracts the Image by rendering the whole page and decoding it from PNG. Kept as a benchmark baseline."""
+        page_num = fig.boxes[0].page
         fig_box = fig.boxes[0].to_absolute(page_wdth, page_hght).xy_coordinates
         fig_box = [el*self.zoom_factor for el in fig_box]
         mat = fitz.Matrix(self.zoom_factor, self.zoom_factor)
@@ -105,16 +142,29 @@ class PapermageScraper(Scraper):
         return cropped_img
 
 
-    def convert_rows_to_markdown(self, doc : Document, proc_rows : List[Dict[str,str|Entity]]) -> str:
-        """Converts extracted rows into markdown format."""
+    def convert_paper_info_to_markdown(self, doc : Document) -> str:
+        """Converts the paper info of the first page into markdown format."""
         content = ''
         title, authors, abstract, keywords = self.extract_paper_info(doc.pages[0])
         content += f"# {title}\n\n"
         content += f"{authors}\n\n"
         content += f"{abstract}\n\n"
         content += f"{keywords}\n"
-        for row_idx, row in enumerate(proc_rows):
+        return content
+
+    def convert_rows_to_markdown(self, doc : Document, proc_rows : List[Dict[str,str|Entity]]) -> str:
+        """Converts extracted rows into markdown format."""
+        content = self.convert_paper_info_to_markdown(doc)
+        content += self.rows_to_markdown(proc_rows, len(proc_rows))
+        self.logger.info("FINISHED CONVERTING EXTRACTED ROWS TO MARKDOWN")
+        return content
 
+    def rows_to_markdown(self, proc_rows : List[Dict[str,str|Entity]], num_rows : int) -> str:
+        """Converts the first num_rows rows into markdown format. Following rows are only used to wrap words."""
+        content = ''
+        for row_idx in range(num_rows):
+
+            row = proc_rows[row_idx]
             row_tipe = row['type']
             row_ent = row['entity']
 
@@ -135,63 +185,222 @@ class PapermageScraper(Scraper):
                     # wrap "wo- \n rd" sequences in "word" 
                 content += f"{row_ent.text}\n"
 
-        self.logger.info("FINISHED CONVERTING EXTRACTED ROWS TO MARKDOWN")
         return content
 
-    def process_document(self, document_path : str) -> Tuple[str, ImageData]:
-        """Processes the document and returns the markdown content and image data."""
+    def process_page(self, doc : Document, page_idx : int, page : Entity, renderer : PageRenderer) -> Tuple[PageRows, ImageData]:
+        """
+        Extracts figures and candidate rows from a single page. Pages are independent of each other,
+        the reference cut-off is applied afterwards by merge_page_rows.
+        Returns:
+            Tuple[PageRows, ImageData]: (type, entity) rows of the page and its image data.
+            Rows belonging to a section are returned as the section entity.
+        """
+        self.logger.info(f"PROCESSING PAGE {page_idx}")
+        page_rows = [x for x in page.intersect_by_span('rows')]
+        page_figs =  page.intersect_by_box('figures')
+        self.logger.debug(f"FOUND {len(page_rows)} ROW(s) AND {len(page_figs)} FIGURE(s) IN PAGE {page_idx}")
 
-        recipe = CoreRecipe()
-        doc = recipe.run(document_path)
-        pdf_doc = fitz.open(document_path)
+        #extract image data from the page
+        image_data : ImageData = []
+        for fig_idx, fig in enumerate(page_figs):
+            caption = self.find_captions_from_image(fig, doc)
+            self.logger.debug(f"FOUND FIGURE {fig_idx} IN PAGE {page_idx}")
+            self.logger.debug(f"FOUND CAPTION {caption}")
+            img = self.extract_image_from_box(renderer, fig)
+            data = {'caption': caption, 'page_id': page_idx, 'fig_id': fig_idx, 'box': fig.boxes[0].to_json()}
+            image_data.append((img, data))
 
-        ref_rows : List[Entity] = [] # content of the references section
-        found_ref = False
+        # extract text data from the page
+        rows : PageRows = []
+        page_index = self.build_page_index(page)
+        for row in page_rows:
+            # skipping rows that belong to preliminary or additional paper sections
+            if self.filter_preliminary_row(row, page_index) or self.filter_row(row, page_index):
+                continue
+            if section := self.get_section(doc, row, page_index):
+                rows.append((self.SECTION, section))
+            else:
+                rows.append((self.PARAGRAPH, row))
+        return rows, image_data
 
-        proc_rows : List[Dict[str,str|Entity]] = []
-        image_data : ImageData = []
-        width, height = doc.images[0]._pilimage.size
-        for page_idx, page in enumerate(doc.pages):
-
-            self.logger.info(f"PROCESSING PAGE {page_idx}")
-            page_rows = [x for x in page.intersect_by_span('rows')]
-            page_figs =  page.intersect_by_box('figures')
-            self.logger.debug(f"FOUND {len(page_rows)} ROW(s) AND {len(page_figs)} FIGURE(s) IN PAGE {page_idx}")
-
-            #extract image data from the page
-            for fig_idx, fig in enumerate(page_figs):
-                caption = self.find_captions_from_image(fig, doc)
-                self.logger.debug(f"FOUND FIGURE {fig_idx} IN PAGE {page_idx}")
-                self.logger.debug(f"FOUND CAPTION {caption}")
-                img = self.extract_image_from_box(pdf_doc, fig, page, width, height)
-                data = {'caption': caption, 'page_id': page_idx, 'fig_id': fig_idx}
-                image_data.append((img, data))
-
-            # extract text data from the page
-            for row_idx, row in enumerate(page_rows):
-                # skipping rows that belong to preliminary or additional paper sections
-                if self.filter_preliminary_row(row, page) or self.filter_row(row, page):
-                    continue
+    def merge_page_rows(self, page_results : Iterable[Tuple[PageRows, ImageData]]) -> Iterator[Tuple[List[Dict[str,str|Entity]], ImageData]]:
+        """
+        Merges the rows of every page in page order, dropping duplicate sections and everything after the references.
+        Yields the processed rows added by each page together with the image data of the page.
+        """
+        found_ref = False
+        seen_sections = set() # Entity has no __eq__, so membership is by identity
+        for page_idx, (page_rows, image_data) in enumerate(page_results):
+            proc_rows : List[Dict[str,str|Entity]] = []
+            for row_type, ent in page_rows:
                 # check if row belongs to a section, if so, add the section to the processed rows
-                if section := self.get_section(doc, row):
+                if row_type == self.SECTION:
                     if found_ref:
                         self.logger.info(f"FOUND NEW SECTION AFTER REFERENCES - STOPPING")
                         break
-                    if section not in [entry['entity'] for entry in proc_rows if entry['type'] == self.SECTION]:
-                        if any(sub in section.text.lower() for sub in ['reference', 'citation', 'bibliograph']):
+                    if ent not in seen_sections:
+                        if any(sub in ent.text.lower() for sub in ['reference', 'citation', 'bibliograph']):
                             self.logger.debug(f"FOUND REFERENCES PARAGRAPH ON PAGE {page_idx}")
                             found_ref = True
                             continue
-                        self.logger.debug(f"ADDED SECTION {section.text}")
-                        proc_rows.append( {'type':self.SECTION, 'entity':section} )
+                        self.logger.debug(f"ADDED SECTION {ent.text}")
+                        proc_rows.append( {'type':self.SECTION, 'entity':ent} )
+                        seen_sections.add(ent)
                     continue
-                
-                if found_ref:
-                    ref_rows.append(row)
-                else:
-                    proc_rows.append( {'type': self.PARAGRAPH, 'entity':row} )
-
-        pdf_doc.close()
-        # convert processed rows into markdown format
-        markdown_content = self.convert_rows_to_markdown(doc, proc_rows)
-        return markdown_content, image_data
\ No newline at end of file
+                # rows after the references are dropped
+                if not found_ref:
+                    proc_rows.append( {'type': self.PARAGRAPH, 'entity':ent} )
+            yield proc_rows, image_data
+
+    def get_num_workers(self, num_pages : int) -> int:
+        """Returns the number of processes to use for the given number of pages."""
+        num_workers = (os.cpu_count() or 1) if self.num_workers < 0 else self.num_workers
+        return max(min(num_workers, num_pages), 1)
+
+    def process_pages(self, doc : Document, document_path : str) -> Iterator[Tuple[PageRows, ImageData]]:
+        """Processes every page of the document sequentially, yielding the results page by page."""
+        pdf_doc = fitz.open(document_path)
+        renderer = PageRenderer(pdf_doc, self.zoom_factor, self.figure_render_mode)
+        try:
+            for page_idx, page in enumerate(doc.pages):
+                yield self.process_page(doc, page_idx, page, renderer)
+        finally:
+            renderer.clear()
+            pdf_doc.close()
+
+    def process_pages_in_parallel(self, doc : Document, document_path : str, num_workers : int) -> Iterator[Tuple[PageRows, ImageData]]:
+        """
+        Processes the pages of the document on a pool of processes, yielding the results in page order.
+        Every worker rebuilds the document from its JSON serialization, rows are sent back as layer ids
+        and mapped back to the entities of doc.
+        """
+        layers = {self.SECTION: doc.get_layer('sections'), self.PARAGRAPH: doc.get_layer('rows')}
+        # spawn, since the scraper usually runs in a worker thread of the chainlit server
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx,
+                                 initializer=_init_page_worker,
+                                 initargs=(doc.to_json(), document_path)) as executor:
+            for page_rows, image_data in executor.map(_process_page_in_worker, range(len(doc.pages))):
+                yield [(row_type, layers[row_type][ent_id]) for row_type, ent_id in page_rows], image_data
+
+    def record_layout(self, merged_pages : Iterable[Tuple[List[Dict[str,str|Entity]], ImageData]],
+                      layout : Dict[str, Any]) -> Iterator[Tuple[List[Dict[str,str|Entity]], ImageData]]:
+        """Records the processed rows and figures of every merged page into layout, passing them through."""
+        for proc_rows, image_data in merged_pages:
+            # texts are recorded before the markdown conversion wraps them
+            layout['pages'].append({
+                'rows': [[row['type'], row['entity'].text] for row in proc_rows],
+                'figures': [dict(mdt) for _, mdt in image_data],
+            })
+            yield proc_rows, image_data
+
+    def replay_layout(self, layout : Dict[str, Any], document_path : str) -> Iterator[Tuple[List[Dict[str,str|Entity]], ImageData]]:
+        """Rebuilds the merged pages of a cached layout. Only the figures are rendered again."""
+        pdf_doc = fitz.open(document_path)
+        renderer = PageRenderer(pdf_doc, self.zoom_factor, self.figure_render_mode)
+        try:
+            for page in layout['pages']:
+                proc_rows = [{'type': row_type, 'entity': SimpleNamespace(text=text)} for row_type, text in page['rows']]
+                image_data : ImageData = []
+                for mdt in page['figures']:
+                    fig = Entity(boxes=[Box.from_json(mdt['box'])])
+                    image_data.append((self.extract_image_from_box(renderer, fig), mdt))
+                yield proc_rows, image_data
+        finally:
+            renderer.clear()
+            pdf_doc.close()
+
+    def stream_fragments(self, header : str, merged_pages : Iterable[Tuple[List[Dict[str,str|Entity]], ImageData]]) -> Iterator[Tuple[str, ImageData]]:
+        """
+        Converts the merged pages into markdown fragments, yielding one fragment per page.
+        A fragment only holds complete sections, so it can be chunked on its own.
+        """
+        pending_rows : List[Dict[str,str|Entity]] = []
+        for proc_rows, image_data in merged_pages:
+            pending_rows.extend(proc_rows)
+            # every row before the last section header is complete
+            last_section = max(
+                (i for i, row in enumerate(pending_rows) if row['type'] == self.SECTION and i > 0), default=0
+            )
+            fragment = ''
+            if last_section > 0:
+                fragment = header + self.rows_to_markdown(pending_rows, last_section)
+                header = '' # the paper info is sent with the first fragment
+                pending_rows = pending_rows[last_section:]
+            yield fragment, image_data
+
+        fragment = header + self.rows_to_markdown(pending_rows, len(pending_rows))
+        self.logger.info("FINISHED CONVERTING EXTRACTED ROWS TO MARKDOWN")
+        yield fragment, []
+
+    def run_recipe(self, recipe : CoreRecipe, document_path : str) -> Document:
+        """
+        Runs the layout analysis of the recipe on the document.
+        With lazy rasterization, page images are rendered on demand at the recipe DPI while the layout
+        predictors go through the pages, and released as soon as the next page is rendered.
+        """
+        if not self.lazy_rasterization:
+            return recipe.run(document_path)
+        doc = recipe.parser.parse(input_pdf_path=document_path)
+        source = LazyPageSource(document_path, recipe.dpi)
+        try:
+            images = source.get_images()
+            doc.annotate_images(images=images)
+            recipe.rasterizer.attach_images(images=images, doc=doc)
+            return recipe.from_doc(doc=doc)
+        finally:
+            source.close() # page images are not used after layout analysis
+
+    def stream_document(self, document_path : str) -> Iterator[Tuple[str, ImageData]]:
+        """
+        Processes the document and yields markdown fragments and image data page by page.
+        If the layout of the document is cached, layout analysis is skipped entirely.
+        """
+
+        file_hash = None
+        if self.layout_cache is not None:
+            with open(document_path, 'rb') as f:
+                file_hash = hash_content(f.read())
+            if (layout := self.layout_cache.load(file_hash)) is not None:
+                self.logger.info(f"FOUND CACHED LAYOUT FOR {file_hash} - SKIPPING LAYOUT ANALYSIS")
+                yield from self.stream_fragments(layout['header'], self.replay_layout(layout, document_path))
+                return
+
+        with RecipePool().borrow() as recipe:
+            doc = self.run_recipe(recipe, document_path)
+
+        start_time = time.perf_counter()
+        num_workers = self.get_num_workers(len(doc.pages))
+        if num_workers > 1:
+            results = self.process_pages_in_parallel(doc, document_path, num_workers)
+        else:
+            results = self.process_pages(doc, document_path)
+
+        layout = {'header': self.convert_paper_info_to_markdown(doc), 'pages': []}
+        merged_pages = self.record_layout(self.merge_page_rows(results), layout)
+        yield from self.stream_fragments(layout['header'], merged_pages)
+        self.logger.info(f"PROCESSED {len(doc.pages)} PAGE(s) WITH {num_workers} WORKER(s) IN {time.perf_counter() - start_time:.2f}s")
+        self.logger.info(f"PEAK RSS: {get_peak_rss_mb():.1f} MB (LAZY RASTERIZATION: {self.lazy_rasterization})")
+        if file_hash is not None:
+            self.layout_cache.save(file_hash, layout)
+
+
+# -- PARALLEL PAGE PROCESSING --
+
+_WORKER_STATE : Dict[str, Any] = {}
+
+def _init_page_worker(doc_json : Dict, document_path : str) -> None:
+    """Initializes a page worker process with its own copy of the document."""
+    scraper = PapermageScraper()
+    pdf_doc = fitz.open(document_path)
+    _WORKER_STATE['scraper'] = scraper
+    _WORKER_STATE['doc'] = Document.from_json(doc_json)
+    _WORKER_STATE['renderer'] = PageRenderer(pdf_doc, scraper.zoom_factor, scraper.figure_render_mode)
+
+def _process_page_in_worker(page_idx : int) -> Tuple[List[Tuple[str, int]], ImageData]:
+    """Processes a page in a worker process. Entities are returned as their id in their layer."""
+    doc = _WORKER_STATE['doc']
+    page_rows, image_data = _WORKER_STATE['scraper'].process_page(
+        doc, page_idx, doc.pages[page_idx], _WORKER_STATE['renderer']
+    )
+    return [(row_type, ent.id) for row_type, ent in page_rows], image_data
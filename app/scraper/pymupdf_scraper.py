@@ -0,0 +1,349 @@
+from app.scraper.scraper import StreamingScraper, ImageData
+from app.scraper.page_renderer import PageRenderer
+from app.config_loader import ConfigLoader
+
+from typing import List, Tuple, Optional, Dict, Any, Iterator
+from collections import Counter
+import fitz
+import logging
+import re
+
+Line = Dict[str, Any]
+# dict contains the following keys:
+# - 'text' : str
+# - 'bbox' : fitz.Rect
+# - 'size' : float - largest font size of the line
+# - 'bold' : bool
+# - 'block' : int - number of the text block of the line
+
+
+class PymupdfScraper(StreamingScraper):
+    """
+    Fast Scraper for born-digital PDFs, based only on the PyMuPDF text layer.
+    Headings are detected from font sizes and weights, figures from embedded images and vector drawings.
+    Produces the same markdown and ImageData contract as PapermageScraper.
+    """
+
+    def __init__(self):
+        super().__init__()
+        scraper_config = ConfigLoader().get_config()['scraper_config']
+        self.zoom_factor = scraper_config['zoom_factor']
+        self.figure_render_mode = scraper_config['figure_render_mode']
+        self.HEADING_SIZE_RATIO = 1.15 # min font size of a heading, relative to the body font size
+        self.MAX_HEADING_LEN = 100
+        self.PAGE_MARGIN = 0.05 # top and bottom part of the page holding running headers and page numbers
+        self.MIN_FIG_SIZE = 0.1 # min width and height of a figure, relative to the page
+        self.MAX_FIG_TEXT_COVERAGE = 0.4 # drawings mostly covered by text are tables, not figures
+        self.MAX_CAPTION_DISTANCE = 0.1 # max vertical distance between a figure and its caption, relative to the page
+        self.MIN_PROBE_CHARS = 200 # min chars per page of a born-digital document
+        self.NUMBERED_HEADING = re.compile(r'^(\d+(\.\d+)*\.?|[IVX]+\.)\s+\S')
+        self.NAMED_HEADINGS = {'abstract', 'introduction', 'background', 'related work', 'method', 'methods',
+                               'experiments', 'results', 'discussion', 'conclusion', 'conclusions',
+                               'acknowledgment', 'acknowledgments', 'acknowledgement', 'acknowledgements',
+                               'references', 'bibliography', 'appendix'}
+        self.FIG_CAPTION = re.compile(r'(?i)^(figure|fig\.?)\s*\d+')
+        self.CAPTION = re.compile(r'(?i)^(figure|fig\.?|table)\s*\d+')
+        self.logger = logging.getLogger(__name__)
+
+    def get_lines(self, page : fitz.Page) -> List[Line]:
+        """Returns the text lines of the page in reading order of the text layer."""
+        lines = []
+        for block in page.get_text('dict', flags=fitz.TEXTFLAGS_TEXT)['blocks']:
+            if block['type'] != 0:
+                continue
+            for line in block['lines']:
+                spans = [span for span in line['spans'] if span['text'].strip()]
+                if not spans:
+                    continue
+                lines.append({
+                    'text': ''.join(span['text'] for span in spans).strip(),
+                    'bbox': fitz.Rect(line['bbox']),
+                    'size': round(max(span['size'] for span in spans), 1),
+                    'bold': all(span['flags'] & fitz.TEXT_FONT_BOLD for span in spans),
+                    'block': block['number'],
+                })
+        return lines
+
+    def get_body_size(self, pages_lines : List[List[Line]]) -> float:
+        """Returns the most used font size, weighted by number of characters."""
+        sizes = Counter()
+        for lines in pages_lines:
+            for line in lines:
+                sizes[line['size']] += len(line['text'])
+        return sizes.most_common(1)[0][0] if sizes else 0.0
+
+    def is_heading(self, line : Line, body_size : float) -> bool:
+        """Returns True if the line looks like a section heading."""
+        text = line['text']
+        if len(text) < 2 or len(text) > self.MAX_HEADING_LEN or not any(c.isalpha() for c in text):
+            return False
+        if line['size'] >= body_size * self.HEADING_SIZE_RATIO:
+            return True
+        if line['bold']:
+            return bool(self.NUMBERED_HEADING.match(text)) or text.lower().rstrip('.:') in self.NAMED_HEADINGS
+        return False
+
+    def is_reference_heading(self, text : str) -> bool:
+        """Returns True if the heading starts the references."""
+        return any(sub in text.lower() for sub in ['reference', 'citation', 'bibliograph'])
+
+    def in_margin(self, line : Line, page_rect : fitz.Rect) -> bool:
+        """Returns True if the line lies in the header or footer area of the page."""
+        margin = page_rect.height * self.PAGE_MARGIN
+        return line['bbox'].y1 <= page_rect.y0 + margin or line['bbox'].y0 >= page_rect.y1 - margin
+
+    def extract_paper_info(self, lines : List[Line], body_size : float) -> Tuple[Tuple[str, str, str, str], set]:
+        """
+        Extracts Title, Authors, Abstract and Keywords from the lines of the first page.
+        Returns:
+            Tuple[Tuple[str, str, str, str], set]: paper info and the indexes of the lines it uses.
+        """
+        used = set()
+        title, authors, abstract, keywords = '', '', '', ''
+        if not lines:
+            return (title, 'Paper Authors: ', 'Paper Abstract: ', 'Paper Keywords: '), used
+
+        # title: first run of lines with the largest font of the page
+        title_size = max(line['size'] for line in lines)
+        title_idx = [i for i, line in enumerate(lines) if line['size'] == title_size]
+        title_end = title_idx[0]
+        while title_end + 1 < len(lines) and lines[title_end + 1]['size'] == title_size:
+            title_end += 1
+        title = ' '.join(lines[i]['text'] for i in range(title_idx[0], title_end + 1))
+        used.update(range(title_idx[0], title_end + 1))
+
+        # abstract: from the line starting with "abstract" to the next heading
+        abstract_start = next((i for i, line in enumerate(lines) if line['text'].lower().startswith('abstract')), None)
+        keywords_start = next((i for i, line in enumerate(lines)
+                               if re.match(r'(?i)^(keywords|index terms)', line['text'])), None)
+        if abstract_start is not None:
+            abstract_end = abstract_start + 1
+            while abstract_end < len(lines) and abstract_end != keywords_start \
+                    and not self.is_heading(lines[abstract_end], body_size):
+                abstract_end += 1
+            abstract = self.join_lines([lines[i]['text'] for i in range(abstract_start, abstract_end)])
+            used.update(range(abstract_start, abstract_end))
+        if keywords_start is not None:
+            keywords_idx = self.follow_block(lines, keywords_start, body_size)
+            keywords = self.join_lines([lines[i]['text'] for i in keywords_idx])
+            used.update(keywords_idx)
+
+        # authors: everything between the title and the abstract
+        authors_end = abstract_start if abstract_start is not None else title_end + 1
+        authors_idx = [i for i in range(title_end + 1, authors_end) if i not in used]
+        authors = ' '.join(lines[i]['text'] for i in authors_idx)
+        used.update(authors_idx)
+
+        authors = 'Paper Authors: ' + authors
+        abstract = 'Paper Abstract: ' + abstract if 'abstract' not in abstract.lower() else abstract
+        keywords = 'Paper Keywords: ' + keywords if 'keywords' not in keywords.lower() else keywords
+        return (title, authors, abstract, keywords), used
+
+    def follow_block(self, lines : List[Line], start : int, body_size : float) -> List[int]:
+        """Returns the indexes of the lines continuing the line at start: same block, no heading and no vertical gap."""
+        idx = [start]
+        while idx[-1] + 1 < len(lines):
+            prev, line = lines[idx[-1]], lines[idx[-1] + 1]
+            if line['block'] != prev['block'] or self.is_heading(line, body_size) \
+                    or line['bbox'].y0 - prev['bbox'].y1 > prev['bbox'].height:
+                break
+            idx.append(idx[-1] + 1)
+        return idx
+
+    def join_lines(self, texts : List[str]) -> str:
+        """Joins lines into a single string, wrapping "wo-" "rd" sequences in "word"."""
+        text = ''
+        for line in texts:
+            if text.endswith('-'):
+                text = text[:-1] + line
+            else:
+                text = f"{text} {line}" if text else line
+        return text
+
+    def find_regions(self, page : fitz.Page, lines : List[Line]) -> Tuple[List[fitz.Rect], List[fitz.Rect]]:
+        """
+        Returns the regions of the page holding embedded images or vector drawings, in reading order:
+        figures, and tables (drawings mostly covered by text).
+        """
+        page_rect = page.rect
+        candidates = [fitz.Rect(info['bbox']) for info in page.get_image_info()]
+        candidates += [fitz.Rect(rect) for rect in page.cluster_drawings()]
+        candidates = [rect & page_rect for rect in candidates]
+        candidates = [rect for rect in candidates if rect.width >= page_rect.width * self.MIN_FIG_SIZE
+                      and rect.height >= page_rect.height * self.MIN_FIG_SIZE]
+
+        # merge overlapping regions, e.g. a bitmap with vector annotations on top
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(candidates)):
+                for j in range(i + 1, len(candidates)):
+                    if candidates[i].intersects(candidates[j]):
+                        candidates[i] = candidates[i] | candidates.pop(j)
+                        merged = True
+                        break
+                if merged:
+                    break
+
+        figures, tables = [], []
+        for rect in candidates:
+            text_area = sum((line['bbox'] & rect).get_area() for line in lines if line['bbox'].intersects(rect))
+            if text_area <= rect.get_area() * self.MAX_FIG_TEXT_COVERAGE:
+                figures.append(rect)
+            else:
+                tables.append(rect)
+        return sorted(figures, key=lambda rect: (rect.y0, rect.x0)), sorted(tables, key=lambda rect: (rect.y0, rect.x0))
+
+    def is_caption_start(self, lines : List[Line], idx : int, regions : List[fitz.Rect], page_rect : fitz.Rect) -> bool:
+        """
+        Returns True if the line starts a figure or table caption: it starts with "Figure n" or "Table n",
+        opens its own block apart from the text above, and lies next to one of the figure or table regions.
+        Body lines such as "Table 2 reports..." wrapped at the start of a line are not captions.
+        """
+        line = lines[idx]
+        if not self.CAPTION.match(line['text']):
+            return False
+        if idx > 0:
+            prev = lines[idx - 1]
+            if prev['block'] == line['block'] and line['bbox'].y0 - prev['bbox'].y1 <= prev['bbox'].height:
+                return False
+        max_distance = page_rect.height * self.MAX_CAPTION_DISTANCE
+        bbox = line['bbox']
+        for region in regions:
+            if bbox.x1 < region.x0 or bbox.x0 > region.x1:
+                continue
+            distance = bbox.y0 - region.y1 if bbox.y0 >= region.y1 else region.y0 - bbox.y1
+            if -1 <= distance <= max_distance:
+                return True
+        return False
+
+    def find_caption(self, fig : fitz.Rect, lines : List[Line], page_rect : fitz.Rect,
+                     body_size : float) -> Optional[Tuple[str, List[int]]]:
+        """Returns the caption closest to the figure and the indexes of its lines, None if there is none."""
+        max_distance = page_rect.height * self.MAX_CAPTION_DISTANCE
+        best, best_distance = None, max_distance
+        for i, line in enumerate(lines):
+            if not self.FIG_CAPTION.match(line['text']):
+                continue
+            bbox = line['bbox']
+            if bbox.x1 < fig.x0 or bbox.x0 > fig.x1:
+                continue
+            distance = bbox.y0 - fig.y1 if bbox.y0 >= fig.y1 else fig.y0 - bbox.y1
+            if -1 <= distance <= best_distance:
+                best, best_distance = i, max(distance, 0)
+        if best is None:
+            return None
+        caption_idx = self.follow_block(lines, best, body_size)
+        return self.join_lines([lines[i]['text'] for i in caption_idx]), caption_idx
+
+    def can_process(self, document_path : str, max_pages : int = 5) -> bool:
+        """
+        Quick probe on the first pages of the document.
+        Returns True if the document has a clean text layer and detectable headings.
+        """
+        with fitz.open(document_path) as pdf_doc:
+            if pdf_doc.needs_pass or len(pdf_doc) == 0:
+                return False
+            pages_lines = []
+            for page in pdf_doc.pages(0, min(max_pages, len(pdf_doc))):
+                text = page.get_text()
+                if len(text.strip()) < self.MIN_PROBE_CHARS or text.count('�') > len(text) * 0.01:
+                    return False # scanned page or broken text layer
+                page_area = page.rect.get_area()
+                if any(fitz.Rect(info['bbox']).get_area() >= page_area * 0.8 for info in page.get_image_info()):
+                    return False # full page image, most likely a scan
+                pages_lines.append(self.get_lines(page))
+        body_size = self.get_body_size(pages_lines)
+        headings = sum(self.is_heading(line, body_size) for lines in pages_lines[1:] for line in lines)
+        headings += sum(self.is_heading(line, body_size) for line in pages_lines[0][1:]) if pages_lines[0] else 0
+        return headings >= 2
+
+    def stream_document(self, document_path : str) -> Iterator[Tuple[str, ImageData]]:
+        """Processes the document and yields markdown fragments and image data page by page."""
+
+        pdf_doc = fitz.open(document_path)
+        renderer = PageRenderer(pdf_doc, self.zoom_factor, self.figure_render_mode)
+        try:
+            pages_lines = [self.get_lines(page) for page in pdf_doc]
+            body_size = self.get_body_size(pages_lines)
+            paper_info, info_idx = self.extract_paper_info(pages_lines[0] if pages_lines else [], body_size)
+            title, authors, abstract, keywords = paper_info
+            header = f"# {title}\n\n{authors}\n\n{abstract}\n\n{keywords}\n" # sent with the first fragment
+
+            found_ref = False
+            seen_sections = set()
+            pending = '' # content of the section that is still open
+            carry = None # last row, kept to wrap it with the next one
+            for page_idx, page in enumerate(pdf_doc):
+                lines = pages_lines[page_idx]
+                page_rect = page.rect
+                skip = set(info_idx) if page_idx == 0 else set()
+
+                # extract image data from the page
+                image_data : ImageData = []
+                figures, tables = self.find_regions(page, lines)
+                for fig_idx, fig in enumerate(figures):
+                    caption = self.find_caption(fig, lines, page_rect, body_size)
+                    if caption is not None:
+                        skip.update(caption[1])
+                    img = renderer.render_region(page_idx, (fig.x0, fig.y0, fig.x1, fig.y1))
+                    box = [fig.x0 / page_rect.width, fig.y0 / page_rect.height,
+                           fig.width / page_rect.width, fig.height / page_rect.height, page_idx]
+                    data = {'caption': caption[0] if caption else None, 'page_id': page_idx, 'fig_id': fig_idx, 'box': box}
+                    image_data.append((img, data))
+                    skip.update(i for i, line in enumerate(lines) if line['bbox'].intersects(fig))
+
+                # extract text data from the page
+                fragment = ''
+                idx = 0
+                while idx < len(lines) and not found_ref:
+                    line = lines[idx]
+                    if idx in skip or self.in_margin(line, page_rect):
+                        idx += 1
+                        continue
+                    if self.is_caption_start(lines, idx, figures + tables, page_rect): # skip the whole caption
+                        idx = self.follow_block(lines, idx, body_size)[-1] + 1
+                        continue
+                    if self.is_heading(line, body_size):
+                        # multi-line headings share their block and font
+                        heading = [line['text']]
+                        while idx + 1 < len(lines) and lines[idx + 1]['block'] == line['block'] \
+                                and lines[idx + 1]['size'] == line['size'] and idx + 1 not in skip:
+                            idx += 1
+                            heading.append(lines[idx]['text'])
+                        idx += 1
+                        heading = self.join_lines(heading)
+                        if heading in seen_sections:
+                            continue
+                        if self.is_reference_heading(heading):
+                            self.logger.debug(f"FOUND REFERENCES PARAGRAPH ON PAGE {page_idx}")
+                            found_ref = True
+                            break
+                        if carry is not None:
+                            pending += f"{carry}\n"
+                            carry = None
+                        # every row before a new heading is complete
+                        fragment += pending
+                        seen_sections.add(heading)
+                        pending = f"\n## {heading}\n\n"
+                        continue
+                    text = line['text']
+                    if carry is not None:
+                        if carry.endswith('-'):
+                            text = self.join_lines([carry, text])
+                        else:
+                            pending += f"{carry}\n"
+                    carry = text
+                    idx += 1
+
+                if fragment and header:
+                    fragment = header + fragment
+                    header = ''
+                yield fragment, image_data
+
+            if carry is not None:
+                pending += f"{carry}\n"
+            yield header + pending, []
+        finally:
+            renderer.clear()
+            pdf_doc.close()
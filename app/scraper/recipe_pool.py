@@ -0,0 +1,90 @@
+from app.config_loader import ConfigLoader
+from papermage.recipes import CoreRecipe
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+import threading
+import time
+
+
+class RecipePool:
+    """
+    Singleton pool of warm CoreRecipe instances shared by the whole process.
+    Recipes are created lazily, up to `recipe_pool_size`, and lent to one document at a time.
+    When every recipe is busy, borrowers wait for one to be returned instead of loading a new one.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = super(RecipePool, cls).__new__(cls)
+                cls._instance._init_pool()
+        return cls._instance
+
+    def _init_pool(self) -> None:
+        """Initializes an empty pool."""
+        scraper_config = ConfigLoader().get_config()['scraper_config']
+        self.size = max(scraper_config['recipe_pool_size'], 1)
+        self.layout_dpi = scraper_config['layout_dpi']
+        self._idle : List[CoreRecipe] = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self._stats = {'loads': 0, 'load_time': 0.0, 'borrows': 0, 'wait_time': 0.0}
+
+    def _acquire(self) -> CoreRecipe:
+        """Returns an idle recipe, loading a new one if the pool is not full yet."""
+        start = time.perf_counter()
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                self._cond.wait()
+            wait_time = time.perf_counter() - start
+            self._stats['borrows'] += 1
+            self._stats['wait_time'] += wait_time
+            if self._idle:
+                avg_load_time = self._stats['load_time'] / self._stats['loads']
+                print(f"Borrowed warm CoreRecipe (waited {wait_time:.2f}s, saved ~{avg_load_time:.2f}s of model loading)")
+                return self._idle.pop()
+            self._created += 1 # reserve the slot, the recipe is loaded outside of the lock
+        try:
+            load_start = time.perf_counter()
+            recipe = CoreRecipe(dpi=self.layout_dpi)
+            load_time = time.perf_counter() - load_start
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['loads'] += 1
+            self._stats['load_time'] += load_time
+        print(f"Loaded new CoreRecipe in {load_time:.2f}s ({self._created}/{self.size} in pool)")
+        return recipe
+
+    def _release(self, recipe : CoreRecipe) -> None:
+        """Returns the recipe to the pool."""
+        with self._cond:
+            self._idle.append(recipe)
+            self._cond.notify()
+
+    @contextmanager
+    def borrow(self) -> Iterator[CoreRecipe]:
+        """Lends a warm recipe for the duration of the with block."""
+        recipe = self._acquire()
+        try:
+            yield recipe
+        finally:
+            self._release(recipe)
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Returns the pool statistics. `saved_load_time` estimates the model loading time saved by
+        reusing warm recipes, based on the average time it took to load one.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+        avg_load_time = stats['load_time'] / stats['loads'] if stats['loads'] else 0.0
+        stats['avg_load_time'] = avg_load_time
+        stats['reuses'] = stats['borrows'] - stats['loads']
+        stats['saved_load_time'] = stats['reuses'] * avg_load_time
+        return stats
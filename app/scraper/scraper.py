@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List, Tuple
+from typing import List, Tuple, Iterator
 from PIL.Image import Image
 
 ImageData = List[Tuple[Image, dict]]
@@ -7,6 +7,7 @@ ImageData = List[Tuple[Image, dict]]
 # - 'caption' : str
 # - 'page_id' : int
 # - 'fig_id' : int
+# - 'box' : List[float] (optional) - [left, top, width, height, page] relative figure box
 
 
 class Scraper(ABC):
@@ -27,4 +28,33 @@ class Scraper(ABC):
         Returns:
             Tuple[str, image_data]: Tuple containing markdown-formatted text and Image data.
         """
-        pass
\ No newline at end of file
+        pass
+
+
+class StreamingScraper(Scraper):
+    """
+    Abstract class for Scrapers that yield their output incrementally.
+    Implement this class to let consumers start processing a document before scraping ends.
+    """
+
+    @abstractmethod
+    def stream_document(self, document_path: str) -> Iterator[Tuple[str, ImageData]]:
+        """
+        Process the document and yield markdown fragments and Image data as soon as they are ready.
+        The first non-empty fragment starts with the paper info, every other fragment starts with
+        a section header, so the concatenation of all fragments is the markdown of the whole document.
+        Args:
+            document_path (str): Path to the document to be processed.
+        Returns:
+            Iterator[Tuple[str, ImageData]]: markdown fragments and the figures that became ready with them.
+        """
+        pass
+
+    def process_document(self, document_path: str) -> Tuple[str, ImageData]:
+        """Process the document by collecting all fragments yielded by stream_document."""
+        markdown_content = ''
+        image_data : ImageData = []
+        for fragment, fragment_images in self.stream_document(document_path):
+            markdown_content += fragment
+            image_data.extend(fragment_images)
+        return markdown_content, image_data
@@ -0,0 +1,70 @@
+from typing import List, Dict, Tuple, Optional
+from papermage.magelib import Entity, Box
+import math
+
+
+class PageBoxIndex:
+    """
+    Spatial index over the boxes of a set of layers on a single page.
+    The page is divided into horizontal bands, each band lists the boxes that touch it.
+    Queries only look at the bands covered by the query box, so a row is compared with
+    the few entities around it instead of every entity of the page.
+    Band lookup only narrows down the candidates, the final overlap test is always exact.
+    """
+
+    def __init__(self, page : Entity, layers : List[str], num_bands : int = 64):
+        self.num_bands = num_bands
+        self.page_num = page.boxes[0].page if page.boxes else None
+        self.entities : Dict[str, List[Entity]] = {}
+        # for every layer and band: list of (entity position, box position) tuples
+        self.bands : Dict[str, List[List[Tuple[int, int]]]] = {}
+        for layer in layers:
+            layer_entities = page.intersect_by_box(layer)
+            layer_bands = [[] for _ in range(num_bands)]
+            for ent_pos, ent in enumerate(layer_entities):
+                for box_pos, box in enumerate(ent.boxes):
+                    first, last = self._band_range(box)
+                    for band in range(first, last + 1):
+                        layer_bands[band].append((ent_pos, box_pos))
+            self.entities[layer] = layer_entities
+            self.bands[layer] = layer_bands
+
+    def _band_range(self, box : Box) -> Tuple[int, int]:
+        """Returns the first and last band touched by the box (inclusive)."""
+        first = min(max(math.floor(box.t * self.num_bands), 0), self.num_bands - 1)
+        last = min(max(math.floor((box.t + box.h) * self.num_bands), 0), self.num_bands - 1)
+        return first, last
+
+    def candidates(self, box : Box, layer : str, first_box_only : bool = False) -> List[Tuple[int, int]]:
+        """Returns the sorted (entity position, box position) pairs sharing a band with the box."""
+        first, last = self._band_range(box)
+        layer_bands = self.bands[layer]
+        found = set()
+        for band in range(first, last + 1):
+            found.update(layer_bands[band])
+        if first_box_only:
+            found = {entry for entry in found if entry[1] == 0}
+        return sorted(found)
+
+    def any_overlap(self, box : Box, layers : List[str]) -> bool:
+        """Returns True if box overlaps the first box of any entity of the given layers."""
+        for layer in layers:
+            for ent_pos, _ in self.candidates(box, layer, first_box_only=True):
+                if box.is_overlap(self.entities[layer][ent_pos].boxes[0]):
+                    return True
+        return False
+
+    def first_intersection(self, ent : Entity, layer : str) -> Optional[Entity]:
+        """
+        Returns the first entity of the layer (in layer order) whose boxes intersect the boxes of ent.
+        Uses the same inclusive comparison as papermage's box indexer.
+        """
+        matches = set()
+        for box in ent.boxes:
+            x1, y1, x2, y2 = box.xy_coordinates
+            for ent_pos, box_pos in self.candidates(box, layer):
+                other = self.entities[layer][ent_pos].boxes[box_pos]
+                ox1, oy1, ox2, oy2 = other.xy_coordinates
+                if other.page == box.page and ox1 <= x2 and ox2 >= x1 and oy1 <= y2 and oy2 >= y1:
+                    matches.add(ent_pos)
+        return self.entities[layer][min(matches)] if matches else None
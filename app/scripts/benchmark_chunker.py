@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+from app.config_loader import ConfigLoader
+from app.scraper.auto_scraper import create_scraper
+from app.processor.splitter_registry import SplitterRegistry
+
+# Compares the recursive token splitter with the single-pass offset chunker on the given documents.
+# Usage: python3 app/scripts/benchmark_chunker.py paper1.pdf [paper2.pdf ...]
+
+if len(sys.argv) < 2:
+    print("Usage: python3 app/scripts/benchmark_chunker.py <pdf_path> [<pdf_path> ...]", file=sys.stderr)
+    sys.exit(1)
+
+configs = ConfigLoader().get_config()
+chunk_config = configs['chunking_config']
+model_name = configs['embedding_config']['tokenizer']
+chunk_size = chunk_config['chunk_size'] - chunk_config['chunk_size_penalty']
+chunk_overlap = int(chunk_size * chunk_config['chunk_overlap_percent'])
+
+registry = SplitterRegistry()
+tokenizer = registry.get_tokenizer(model_name)
+markdown_splitter = registry.get_markdown_splitter([("##", "chapter")])
+splitters = {
+    'recursive': registry.get_token_splitter(model_name, chunk_size, chunk_overlap),
+    'offset': registry.get_token_chunker(model_name, chunk_size, chunk_overlap),
+}
+scraper = create_scraper()
+print(f"chunk size: {chunk_size} tokens, overlap: {chunk_overlap} tokens")
+
+for document_path in sys.argv[1:]:
+    md, _ = scraper.process_document(document_path)
+    sections = markdown_splitter.split_text(md)[1:] # skip paper info
+    print(f"\n📄 {os.path.basename(document_path)} - {len(sections)} section(s), {len(md)} characters")
+    timings = {}
+    for name, splitter in splitters.items():
+        start = time.perf_counter()
+        splits = splitter.split_documents(sections)
+        timings[name] = time.perf_counter() - start
+        lengths = [len(tokenizer.encode(split.page_content, add_special_tokens=False)) for split in splits]
+        max_length = max(lengths) if lengths else 0
+        chapters_kept = {s.metadata.get('chapter') for s in splits} == {s.metadata.get('chapter') for s in sections if s.page_content.strip()}
+        print(f"  {name:<10}: {timings[name]:8.3f}s, {len(splits):4d} chunk(s), "
+              f"max {max_length} tokens, chapter metadata kept: {chapters_kept}")
+    speedup = timings['recursive'] / timings['offset'] if timings['offset'] > 0 else float('inf')
+    print(f"  speedup   : {speedup:.1f}x")
@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+import fitz
+from papermage.recipes import CoreRecipe
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+from app.scraper.papermage_scraper import PapermageScraper
+from app.scraper.page_renderer import PageRenderer, CLIP, PAGE
+
+# Compares the figure extraction paths of PapermageScraper on the given documents.
+# Usage: python3 app/scripts/benchmark_figures.py paper1.pdf [paper2.pdf ...]
+
+if len(sys.argv) < 2:
+    print("Usage: python3 app/scripts/benchmark_figures.py <pdf_path> [<pdf_path> ...]", file=sys.stderr)
+    sys.exit(1)
+
+scraper = PapermageScraper()
+recipe = CoreRecipe()
+
+for document_path in sys.argv[1:]:
+    doc = recipe.run(document_path)
+    pdf_doc = fitz.open(document_path)
+    width, height = pdf_doc[0].rect.size
+    figs = [fig for page in doc.pages for fig in page.intersect_by_box('figures')]
+    print(f"\n📄 {os.path.basename(document_path)} - {len(doc.pages)} page(s), {len(figs)} figure(s)")
+
+    start = time.perf_counter()
+    for fig in figs:
+        scraper.extract_image_from_box_png(pdf_doc, fig, width, height)
+    baseline = time.perf_counter() - start
+    print(f"  png round-trip : {baseline:8.3f}s")
+
+    for mode in (CLIP, PAGE):
+        renderer = PageRenderer(pdf_doc, scraper.zoom_factor, mode)
+        start = time.perf_counter()
+        for fig in figs:
+            scraper.extract_image_from_box(renderer, fig)
+        elapsed = time.perf_counter() - start
+        renderer.clear()
+        speedup = baseline / elapsed if elapsed > 0 else float('inf')
+        print(f"  {mode + ' render':<15}: {elapsed:8.3f}s ({speedup:.1f}x)")
+    pdf_doc.close()
@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+import multiprocessing
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+# Reports the peak RSS of PapermageScraper with and without lazy page rasterization.
+# Every run happens in a fresh process, so the peaks do not affect each other.
+# Usage: python3 app/scripts/benchmark_memory.py <pdf_path>
+
+def run_scraper(document_path : str, lazy_rasterization : bool, results) -> None:
+    """Scrapes the document in the current process and stores elapsed time and peak RSS in results."""
+    from app.scraper.papermage_scraper import PapermageScraper
+    from app.scripts.utils import get_peak_rss_mb
+    scraper = PapermageScraper()
+    scraper.layout_cache = None # always run layout analysis
+    scraper.lazy_rasterization = lazy_rasterization
+    start = time.perf_counter()
+    scraper.process_document(document_path)
+    results[lazy_rasterization] = (time.perf_counter() - start, get_peak_rss_mb())
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 app/scripts/benchmark_memory.py <pdf_path>", file=sys.stderr)
+        sys.exit(1)
+
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Manager().dict()
+    for lazy_rasterization in (False, True):
+        proc = ctx.Process(target=run_scraper, args=(sys.argv[1], lazy_rasterization, results))
+        proc.start()
+        proc.join()
+
+    print(f"\n📄 {os.path.basename(sys.argv[1])}")
+    for lazy_rasterization, (elapsed, peak_rss) in results.items():
+        mode = 'lazy' if lazy_rasterization else 'eager'
+        print(f"  {mode:<6}: {elapsed:8.2f}s - peak RSS {peak_rss:8.1f} MB")
@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import subprocess
+import statistics
+
+# Measures the cold start of the app in fresh processes: the time to `import main`, the time to set up
+# the first chat session (what on_chat_start loads) and which heavy modules were imported by then.
+# Time to first message is the sum of the two.
+# Usage: python3 app/scripts/benchmark_startup.py [runs]
+
+HEAVY_MODULES = ['torch', 'transformers', 'papermage', 'fitz', 'litellm', 'langchain_text_splitters']
+
+PROBE = f"""
+import sys, time, json
+start = time.perf_counter()
+import main
+import_time = time.perf_counter() - start
+import_modules = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+
+from app.config_loader import ConfigLoader
+from app.resource_registry import ResourceRegistry
+configs = ConfigLoader().get_config()
+start = time.perf_counter()
+registry = ResourceRegistry()
+for collection_name in (configs['qdrant_config']['text_collection_name'], configs['qdrant_config']['image_collection_name']):
+    registry.get_vector_store(collection_name)
+    registry.get_paper_index(collection_name)
+registry.get_chains()
+session_time = time.perf_counter() - start
+session_modules = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+print(json.dumps({{'import': import_time, 'session': session_time, 'import_modules': import_modules, 'session_modules': session_modules}}))
+"""
+
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+results = []
+for i in range(runs):
+    proc = subprocess.run([sys.executable, "-c", PROBE], cwd=root, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(proc.stderr, file=sys.stderr)
+        sys.exit(1)
+    results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    print(f"run {i + 1}: import main {results[-1]['import']:.2f}s, first session {results[-1]['session']:.2f}s")
+
+import_times = [r['import'] for r in results]
+first_message_times = [r['import'] + r['session'] for r in results]
+print(f"\nimport main          : median {statistics.median(import_times):.2f}s, min {min(import_times):.2f}s")
+print(f"time to first message: median {statistics.median(first_message_times):.2f}s, min {min(first_message_times):.2f}s")
+print(f"heavy modules after import main  : {', '.join(results[-1]['import_modules']) or 'none'}")
+print(f"heavy modules after first session: {', '.join(results[-1]['session_modules']) or 'none'}")
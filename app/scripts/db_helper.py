@@ -6,11 +6,23 @@ import threading
 _DB_CONNECTIONS = {}
 _DB_PATH = "app/storage/sqlite/contents.db"
 
+def create_paper_markdown_table(conn: sqlite3.Connection) -> None:
+    """Create the paper_markdown table, missing from databases created before it was added."""
+    conn.execute("""\
+    CREATE TABLE IF NOT EXISTS paper_markdown (
+        id VARCHAR(32) PRIMARY KEY, 
+        content TEXT NOT NULL,
+        FOREIGN KEY (id) REFERENCES papers(id)
+    )""")
+    conn.commit()
+
 def get_db_connection():
     """Get a thread-local database connection"""
     thread_id = threading.get_ident()
     if thread_id not in _DB_CONNECTIONS:
-        _DB_CONNECTIONS[thread_id] = sqlite3.connect(_DB_PATH)
+        conn = sqlite3.connect(_DB_PATH)
+        create_paper_markdown_table(conn)
+        _DB_CONNECTIONS[thread_id] = conn
     return _DB_CONNECTIONS[thread_id]
 
 def close_db_connection():
@@ -68,9 +80,36 @@ def delete_file_from_db(file_id: str) -> None:
     cursor.execute("DELETE FROM papers WHERE id=?", (file_id,))
     conn.commit()
 
+def delete_paper_data(file_id: str) -> None:
+    """Delete a file and everything stored about it from the database."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM papers WHERE id=?", (file_id,))
+    cursor.execute("DELETE FROM paper_info WHERE id=?", (file_id,))
+    cursor.execute("DELETE FROM paper_markdown WHERE id=?", (file_id,))
+    conn.commit()
+
 def insert_paper_info(paper_id: str, content: str) -> None:
-    """Insert paper info into the database."""
+    """Insert paper info into the database, replacing the one of a previous run on the same paper."""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('INSERT INTO paper_info VALUES (?,?)', (paper_id, content))
+    cursor.execute('INSERT OR REPLACE INTO paper_info VALUES (?,?)', (paper_id, content))
     conn.commit()
+
+def save_paper_markdown(paper_id: str, content: str) -> None:
+    """Save the markdown of a paper into the database, replacing the previous one."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('INSERT OR REPLACE INTO paper_markdown VALUES (?,?)', (paper_id, content))
+    conn.commit()
+
+def get_paper_markdown(paper_id: str) -> Optional[str]:
+    """Get the markdown of a paper, None if it was not stored."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT content FROM paper_markdown WHERE id=?", (paper_id,))
+    except sqlite3.OperationalError: # no paper_markdown table, nothing was stored
+        return None
+    result = cursor.fetchone()
+    return result[0] if result else None
@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from langchain_ollama import OllamaEmbeddings
+from langchain_qdrant import QdrantVectorStore
+from transformers import AutoModel, AutoImageProcessor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+from app.config_loader import ConfigLoader
+from app.scripts.qdrant_helper import get_qdrant_client
+from app.scraper.auto_scraper import create_scraper
+from app.processor.langchain_processor import LangchainProcessor
+from app.scripts.utils import hash_content
+from app.scripts.db_helper import does_file_exist, save_file_to_db, delete_paper_data
+
+# Ingests every PDF of a directory, or every PDF listed in a manifest file (one path per line), without the chat.
+# Progress is checkpointed, so running the command again after a crash resumes where it stopped.
+# Usage: python3 app/scripts/ingest.py <directory|manifest> [--workers N]
+
+CHECKPOINT_PATH = os.path.join("app", "storage", "ingest_checkpoint.json")
+
+
+class Checkpoint:
+    """Status of every paper of the ingestion, saved atomically after every change."""
+
+    def __init__(self, path : str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.papers : Dict[str, Dict[str, str]] = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.papers = json.load(f)
+
+    def set_status(self, file_id : str, pdf_path : str, status : str, error : str = '') -> None:
+        with self._lock:
+            self.papers[file_id] = {'path': pdf_path, 'status': status, 'error': error}
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.papers, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def get_status(self, file_id : str) -> str:
+        with self._lock:
+            return self.papers.get(file_id, {}).get('status', '')
+
+
+def list_pdfs(source : str) -> List[str]:
+    """Returns the PDFs of the directory, searched recursively, or the ones listed in the manifest."""
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(source)
+            for name in names if name.lower().endswith('.pdf')
+        )
+    with open(source, 'r') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+parser = argparse.ArgumentParser(description="Ingest a directory or a manifest of PDFs into PaperSage.")
+parser.add_argument("source", help="directory of PDFs or manifest file with one PDF path per line")
+parser.add_argument("--workers", type=int, default=2, help="papers processed at the same time")
+args = parser.parse_args()
+
+configs = ConfigLoader().get_config()
+checkpoint = Checkpoint(CHECKPOINT_PATH)
+timings = {'hash': 0.0, 'scrape': 0.0, 'process': 0.0}
+timings_lock = threading.Lock()
+
+def add_timing(stage : str, elapsed : float) -> None:
+    with timings_lock:
+        timings[stage] += elapsed
+
+# step 1. hash and dedupe the PDFs
+start = time.perf_counter()
+pending : List[Tuple[str, str]] = []
+seen = set()
+skipped = 0
+for pdf_path in list_pdfs(args.source):
+    with open(pdf_path, "rb") as f:
+        file_id = hash_content(f.read())
+    if file_id in seen:
+        skipped += 1
+        continue
+    seen.add(file_id)
+    if does_file_exist(file_id):
+        if checkpoint.get_status(file_id) != 'in_progress':
+            skipped += 1
+            continue
+        # the previous run stopped while processing this paper, remove what it left behind
+        print(f"Resuming interrupted paper {pdf_path}")
+        delete_paper_data(file_id)
+    pending.append((file_id, pdf_path))
+add_timing('hash', time.perf_counter() - start)
+print(f"{len(pending)} paper(s) to ingest, {skipped} skipped as duplicate or already ingested.")
+
+# step 2. load the shared resources
+print("Loading models...")
+client = get_qdrant_client()
+text_vs = QdrantVectorStore(
+    client=client,
+    collection_name=configs['qdrant_config']['text_collection_name'],
+    embedding=OllamaEmbeddings(model=configs['embedding_config']['model'])
+)
+img_proc = AutoImageProcessor.from_pretrained(configs['embedding_config']['image_model'])
+img_emb = AutoModel.from_pretrained(configs['embedding_config']['image_model'], trust_remote_code=True)
+scrapers = threading.local() # every worker gets its own scraper
+
+def ingest(file_id : str, pdf_path : str) -> bool:
+    """Scrapes and processes a paper, returns True on success."""
+    checkpoint.set_status(file_id, pdf_path, 'in_progress')
+    try:
+        save_file_to_db(file_id, os.path.basename(pdf_path))
+        if not hasattr(scrapers, 'scraper'):
+            scrapers.scraper = create_scraper()
+        stage_start = time.perf_counter()
+        md, img_data = scrapers.scraper.process_document(pdf_path)
+        add_timing('scrape', time.perf_counter() - stage_start)
+        stage_start = time.perf_counter()
+        LangchainProcessor(md, img_data, file_id, text_vs, img_emb, img_proc).process()
+        add_timing('process', time.perf_counter() - stage_start)
+    except Exception as e:
+        print(f"❌ Failed to ingest {pdf_path}: {e}")
+        delete_paper_data(file_id)
+        checkpoint.set_status(file_id, pdf_path, 'failed', str(e))
+        return False
+    checkpoint.set_status(file_id, pdf_path, 'done')
+    print(f"✅ Ingested {pdf_path}")
+    return True
+
+# step 3. ingest the papers across the worker pool
+start = time.perf_counter()
+try:
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+        results = list(executor.map(lambda paper: ingest(*paper), pending))
+finally:
+    client.close()
+elapsed = time.perf_counter() - start
+
+ingested = sum(results)
+print(f"\nIngested {ingested}/{len(pending)} paper(s) in {elapsed:.1f}s "
+      f"({ingested / elapsed * 60 if elapsed > 0 else 0.0:.1f} papers/min), {len(pending) - ingested} failed.")
+for stage, stage_time in timings.items(): # summed across workers
+    print(f"  {stage:<8}: {stage_time:8.1f}s")
+if ingested < len(pending):
+    print(f"Failed papers are listed in {CHECKPOINT_PATH}, run the command again to retry them.")
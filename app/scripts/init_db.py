@@ -1,11 +1,12 @@
 import os
 import sqlite3
-from qdrant_client import QdrantClient, models
 import os
 import sys
 
 sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
 from app.config_loader import ConfigLoader
+from app.scripts.qdrant_helper import get_qdrant_client, get_quantization_config, get_vectors_config
+from app.scripts.db_helper import create_paper_markdown_table
 
 
 configs = ConfigLoader().get_config()
@@ -37,6 +38,8 @@ CREATE TABLE IF NOT EXISTS paper_info (
     FOREIGN KEY (id) REFERENCES papers(id)
 )""")
 
+create_paper_markdown_table(conn)
+
 conn.commit()
 c.close()
 conn.close()
@@ -47,7 +50,7 @@ print("Creating Qdrant collections...")
 qdrantdir_path = os.path.join("app", "storage", "qdrant")
 os.makedirs(qdrantdir_path, exist_ok=True)
 
-client = QdrantClient(path=os.path.join(qdrantdir_path, "vectorstore"))
+client = get_qdrant_client()
 emb_dize = configs['embedding_config']['output_length']
 same_length = configs['embedding_config']['use_same_output_length']
 
@@ -55,10 +58,8 @@ try:
     # text collection
     client.create_collection(
         collection_name=configs['qdrant_config']['text_collection_name'], 
-        vectors_config=models.VectorParams(
-                size=emb_dize, 
-                distance=models.Distance.COSINE
-        )
+        vectors_config=get_vectors_config(emb_dize),
+        quantization_config=get_quantization_config()
     )
 except ValueError as e:
     if 'already exists' in str(e):
@@ -70,10 +71,8 @@ try:
     #image collection
     client.create_collection(
         collection_name=configs['qdrant_config']['image_collection_name'], 
-        vectors_config=models.VectorParams(
-                size=emb_dize if same_length else configs['embedding_config']['img_output_length'], 
-                distance=models.Distance.COSINE
-        )
+        vectors_config=get_vectors_config(emb_dize if same_length else configs['embedding_config']['img_output_length']),
+        quantization_config=get_quantization_config()
     )
     print("✅ Qdrant collections created.")
 except ValueError as e:
@@ -0,0 +1,111 @@
+import os
+import sys
+import argparse
+from typing import Dict, Optional
+from qdrant_client import QdrantClient, models
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+from app.config_loader import ConfigLoader
+from app.scripts.qdrant_helper import get_qdrant_client, get_quantization_config
+
+# Applies the quantization and on-disk settings of qdrant_config to the existing collections, reporting
+# their estimated memory use and their recall@k against exact search before and after the migration.
+# Usage: python3 app/scripts/migrate_qdrant.py [--report-only] [--samples N] [--k K]
+
+def get_collection_search_params(info : models.CollectionInfo) -> Optional[models.SearchParams]:
+    """Get the search parameters used at query time for the collection as it is configured now."""
+    if info.config.quantization_config is None:
+        return None
+    qdrant_config = ConfigLoader().get_config()['qdrant_config']
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(
+            rescore=qdrant_config['rescore'], oversampling=qdrant_config['oversampling']
+        )
+    )
+
+def estimate_memory_mb(info : models.CollectionInfo) -> Dict[str, float]:
+    """Estimate the RAM and disk used by the vectors of the collection, in MB."""
+    num_points = info.points_count or 0
+    params = info.config.params.vectors
+    original = num_points * params.size * 4 # float32
+    quantized = 0
+    quantization = info.config.quantization_config
+    if isinstance(quantization, models.ScalarQuantization):
+        quantized = num_points * params.size
+        quantized_in_ram = quantization.scalar.always_ram is not False
+    elif isinstance(quantization, models.BinaryQuantization):
+        quantized = num_points * params.size / 8
+        quantized_in_ram = quantization.binary.always_ram is not False
+    else:
+        quantized_in_ram = True
+    ram = (0 if params.on_disk else original) + (quantized if quantized_in_ram else 0)
+    disk = (original if params.on_disk else 0) + (0 if quantized_in_ram else quantized)
+    return {'ram': ram / 2**20, 'disk': disk / 2**20}
+
+def recall_at_k(client : QdrantClient, collection_name : str, search_params : Optional[models.SearchParams],
+                samples : int, k : int) -> Optional[float]:
+    """Measure recall@k of the configured search against exact search, using stored vectors as queries."""
+    records, _ = client.scroll(collection_name=collection_name, limit=samples, with_payload=False, with_vectors=True)
+    if not records:
+        return None
+    total = 0.0
+    for record in records:
+        exact = client.query_points(
+            collection_name=collection_name, query=record.vector, limit=k, search_params=models.SearchParams(exact=True)
+        ).points
+        approx = client.query_points(
+            collection_name=collection_name, query=record.vector, limit=k, search_params=search_params
+        ).points
+        total += len({p.id for p in exact} & {p.id for p in approx}) / max(len(exact), 1)
+    return total / len(records)
+
+def report(client : QdrantClient, collection_name : str, samples : int, k : int, label : str) -> None:
+    """Print the memory estimate and the recall@k of the collection."""
+    info = client.get_collection(collection_name)
+    memory = estimate_memory_mb(info)
+    recall = recall_at_k(client, collection_name, get_collection_search_params(info), samples, k)
+    quantization = type(info.config.quantization_config).__name__ if info.config.quantization_config else 'none'
+    recall_str = f"{recall:.3f}" if recall is not None else "n/a (empty collection)"
+    print(f"  {label:<6}: {info.points_count} point(s), quantization {quantization}, "
+          f"on disk {bool(info.config.params.vectors.on_disk)}, ~{memory['ram']:.1f}MB RAM, "
+          f"~{memory['disk']:.1f}MB disk, recall@{k} {recall_str}")
+
+def migrate(client : QdrantClient, collection_name : str) -> None:
+    """Apply the quantization and on-disk settings of qdrant_config to the collection."""
+    quantization = get_quantization_config()
+    client.update_collection(
+        collection_name=collection_name,
+        vectors_config={"": models.VectorParamsDiff(
+            on_disk=ConfigLoader().get_config()['qdrant_config']['on_disk_vectors']
+        )},
+        quantization_config=quantization if quantization is not None else models.Disabled.DISABLED
+    )
+
+
+parser = argparse.ArgumentParser(description="Migrate the Qdrant collections to the quantization set in qdrant_config.")
+parser.add_argument("--report-only", action="store_true", help="only report memory use and recall, do not migrate")
+parser.add_argument("--samples", type=int, default=100, help="stored vectors used as queries to measure recall")
+parser.add_argument("--k", type=int, default=5, help="k of recall@k")
+args = parser.parse_args()
+
+configs = ConfigLoader().get_config()
+client = get_qdrant_client()
+local_store = not configs['qdrant_config']['url']
+if local_store:
+    print("The local store keeps full-precision vectors in memory and ignores quantization, "
+          "set qdrant_config.url to a Qdrant server to use it.")
+
+try:
+    for collection_name in (configs['qdrant_config']['text_collection_name'],
+                            configs['qdrant_config']['image_collection_name']):
+        print(f"\nCollection {collection_name}")
+        report(client, collection_name, args.samples, args.k, "before")
+        if args.report_only or local_store:
+            continue
+        migrate(client, collection_name)
+        # qdrant rebuilds the quantized vectors in the background, recall is measured on the new config
+        report(client, collection_name, args.samples, args.k, "after")
+    if not args.report_only and not local_store:
+        print("\n✅ Collections migrated.")
+finally:
+    client.close()
@@ -0,0 +1,51 @@
+import os
+from typing import Optional
+from qdrant_client import QdrantClient, models
+from app.config_loader import ConfigLoader
+
+_QDRANT_PATH = os.path.join("app", "storage", "qdrant", "vectorstore")
+
+def get_qdrant_client() -> QdrantClient:
+    """Get a client of the Qdrant server set in qdrant_config, or of the local store if no url is set."""
+    qdrant_config = ConfigLoader().get_config()['qdrant_config']
+    if qdrant_config['url']:
+        return QdrantClient(url=qdrant_config['url'])
+    return QdrantClient(path=_QDRANT_PATH)
+
+def get_quantization_config() -> Optional[models.QuantizationConfig]:
+    """Get the quantization set in qdrant_config: none, scalar (int8) or binary."""
+    qdrant_config = ConfigLoader().get_config()['qdrant_config']
+    quantization = qdrant_config['quantization']
+    always_ram = qdrant_config['quantization_always_ram']
+    if quantization == 'none':
+        return None
+    if quantization == 'scalar':
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=always_ram)
+        )
+    if quantization == 'binary':
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=always_ram))
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+def get_vectors_config(size: int) -> models.VectorParams:
+    """Get the vector parameters of a collection, storing the original vectors on disk if on_disk_vectors is set."""
+    return models.VectorParams(
+        size=size,
+        distance=models.Distance.COSINE,
+        on_disk=ConfigLoader().get_config()['qdrant_config']['on_disk_vectors']
+    )
+
+def get_search_params() -> Optional[models.SearchParams]:
+    """
+    Get the search parameters matching the quantization. Candidates are searched on the quantized vectors,
+    oversampled and, if rescore is set, re-ranked with the original vectors.
+    """
+    qdrant_config = ConfigLoader().get_config()['qdrant_config']
+    if qdrant_config['quantization'] == 'none':
+        return None
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(
+            rescore=qdrant_config['rescore'],
+            oversampling=qdrant_config['oversampling']
+        )
+    )
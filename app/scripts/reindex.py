@@ -0,0 +1,46 @@
+import os
+import sys
+import time
+from langchain_ollama import OllamaEmbeddings
+from langchain_qdrant import QdrantVectorStore
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+from app.config_loader import ConfigLoader
+from app.scripts.qdrant_helper import get_qdrant_client
+from app.processor.langchain_processor import LangchainProcessor
+from app.scripts.db_helper import get_available_papers, get_paper_markdown, close_all_connections
+
+# Re-chunks the stored markdown of the given papers (all papers if none is given) with the current
+# chunking_config and embedding_config, embedding and upserting only the chunks that changed.
+# Usage: python3 app/scripts/reindex.py [paper_id ...]
+
+configs = ConfigLoader().get_config()
+paper_ids = sys.argv[1:] or [paper_id for paper_id, _ in get_available_papers()]
+
+client = get_qdrant_client()
+text_vs = QdrantVectorStore(
+    client=client,
+    collection_name=configs['qdrant_config']['text_collection_name'],
+    embedding=OllamaEmbeddings(model=configs['embedding_config']['model'])
+)
+
+try:
+    start = time.perf_counter()
+    totals = {'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    for paper_id in paper_ids:
+        md = get_paper_markdown(paper_id)
+        if md is None:
+            print(f"No markdown stored for paper {paper_id}, process its PDF again to re-index it.")
+            continue
+        processor = LangchainProcessor(md, [], paper_id, text_vs, None, None)
+        stats = processor.reindex()
+        for key, value in stats.items():
+            totals[key] += value
+        print(f"Paper {paper_id}: {stats['added']} added, {stats['updated']} updated, "
+              f"{stats['deleted']} deleted, {stats['unchanged']} unchanged")
+    print(f"✅ Re-indexed {len(paper_ids)} paper(s) in {time.perf_counter() - start:.1f}s: "
+          f"{totals['added']} chunk(s) embedded, {totals['updated']} updated, {totals['deleted']} deleted, "
+          f"{totals['unchanged']} unchanged.")
+finally:
+    close_all_connections()
+    client.close()
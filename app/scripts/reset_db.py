@@ -2,10 +2,12 @@ import sqlite3
 import os
 import sys
 import shutil
-from qdrant_client import models, QdrantClient
+from qdrant_client import models
 
 sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
 from app.config_loader import ConfigLoader
+from app.scripts.qdrant_helper import get_qdrant_client
+from app.scripts.db_helper import create_paper_markdown_table
 
 def delete_from_collection_with_id(collection_name : str, paper_id : str):
     """
@@ -33,13 +35,13 @@ config = ConfigLoader().get_config()
 
 db_path = os.path.join("app", "storage", "sqlite", "contents.db")
 conn = sqlite3.connect(db_path)
+create_paper_markdown_table(conn) # databases created before the markdown was stored lack the table
 cursor = conn.cursor()
 
 
 try:
 
-    qdrantclient_path = os.path.join("app", "storage", "qdrant", "vectorstore")
-    client = QdrantClient(path=qdrantclient_path)
+    client = get_qdrant_client()
     
     if paper_id:
 
@@ -49,6 +51,7 @@ try:
         cursor.execute("DELETE FROM papers WHERE id = ?", (paper_id,))
         cursor.execute("DELETE FROM paper_info WHERE id = ?", (paper_id,))
         deleted_rows = cursor.rowcount
+        cursor.execute("DELETE FROM paper_markdown WHERE id = ?", (paper_id,))
         conn.commit()
         
         if deleted_rows == 0:
@@ -79,6 +82,7 @@ try:
 
         cursor.execute("DELETE FROM papers")
         cursor.execute("DELETE FROM paper_info")
+        cursor.execute("DELETE FROM paper_markdown")
         conn.commit()
         print("All papers deleted from SQLite database.")
         
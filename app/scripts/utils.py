@@ -1,11 +1,16 @@
 import hashlib
+import resource
+import sys
+import queue
+import threading
 from PIL import Image
-from typing import Any, List
-from torch.functional import F
+from typing import Any, List, Iterator, TypeVar
 
+T = TypeVar('T')
 
-async def calculate_hash(content : bytes, buffer_size : int = 4096) -> str:
-    """[ASYNC] Returns the truncated hash of the content using a buffer with `buffer_size` chunks."""
+
+def hash_content(content : bytes, buffer_size : int = 4096) -> str:
+    """Returns the truncated hash of the content using a buffer with `buffer_size` chunks."""
     hash_obj = hashlib.md5()
     for i in range(0, len(content), buffer_size):
         chunk = content[i:i+buffer_size]
@@ -14,6 +19,16 @@ async def calculate_hash(content : bytes, buffer_size : int = 4096) -> str:
     truncated_hash = full_hash[:len(full_hash)//2]
     return truncated_hash
 
+def get_peak_rss_mb() -> float:
+    """Returns the peak resident set size of the current process in MB."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes on Linux
+    return peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+
+async def calculate_hash(content : bytes, buffer_size : int = 4096) -> str:
+    """[ASYNC] Returns the truncated hash of the content using a buffer with `buffer_size` chunks."""
+    return hash_content(content, buffer_size)
+
 def embed_image(image : Image, img_model : Any, processor : Any, shortest_edge = 224) -> List[float]:
     """
     Embeds the image using the image model.
@@ -25,8 +40,71 @@ def embed_image(image : Image, img_model : Any, processor : Any, shortest_edge =
     Returns:
         List[float]: List of floats representing the image embedding.
     """
-    # Process the image with the processor
-    inputs = processor(image, return_tensors="pt", size={"shortest_edge": shortest_edge})
-    img_emb = img_model(**inputs).last_hidden_state
-    img_embeddings = F.normalize(img_emb[:, 0], p=2, dim=1)
-    return img_embeddings[0].tolist()
\ No newline at end of file
+    return embed_images([image], img_model, processor, shortest_edge)[0]
+
+def embed_images(images : List[Image], img_model : Any, processor : Any, shortest_edge = 224,
+                 batch_size : int = 16, num_threads : int = 0) -> List[List[float]]:
+    """
+    Embeds the images in batches using the image model, without tracking gradients.
+    Args:
+        images (List[Image]): List of Image objects.
+        img_model (Any): Image model loaded with AutoModel.
+        processor (Any): Processor loaded with AutoImageProcessor.
+        shortest_edge (int): Shortest edge parameter to pass to processor.
+        batch_size (int): Number of images per forward pass.
+        num_threads (int): Number of torch threads, 0 keeps the current setting.
+    Returns:
+        List[List[float]]: List of image embeddings, in the same order as images.
+    """
+    import torch # only needed to embed figures, importing it slows down the app startup
+    from torch.functional import F
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    embeddings = []
+    with torch.inference_mode():
+        for start in range(0, len(images), max(batch_size, 1)):
+            batch = images[start:start + batch_size]
+            inputs = processor(batch, return_tensors="pt", size={"shortest_edge": shortest_edge})
+            img_emb = img_model(**inputs).last_hidden_state
+            img_embeddings = F.normalize(img_emb[:, 0], p=2, dim=1)
+            embeddings.extend(img_embeddings.tolist())
+    return embeddings
+
+def prefetch(iterator : Iterator[T], maxsize : int = 2) -> Iterator[T]:
+    """
+    Runs the iterator in a background thread, keeping up to `maxsize` items ready for the consumer.
+    Exceptions raised by the iterator are re-raised in the consumer.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+    errors = []
+
+    def put(item) -> bool:
+        """Puts the item in the queue, returns False if the consumer stopped in the meantime."""
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while (item := items.get()) is not done:
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
@@ -2,31 +2,29 @@ import chainlit as cl
 from chainlit.input_widget import Select, Switch
 from chainlit.element import Element
 
-from app.scraper.papermage_scraper import PapermageScraper
-from app.processor.langchain_processor import LangchainProcessor
-from app.scraper.scraper import Scraper, ImageData
-from app.scripts.utils import calculate_hash
+from app.scraper.scraper import Scraper, StreamingScraper, ImageData
+from app.processor.processor import Processor
+from app.processor.figure_store import get_image_payload
+from app.processor.paper_index import PaperIndex
+from app.processor.query_cache import normalize_query
+from app.resource_registry import ResourceRegistry
+from app.scripts.utils import calculate_hash, prefetch
+from app.scripts.qdrant_helper import get_search_params
 from app.scripts.db_helper import (
     get_db_connection, close_db_connection, get_paper_info, 
-    get_available_papers, does_file_exist, save_file_to_db, delete_file_from_db, close_all_connections
-)
-from app.prompts import (
-    rewrite_chat_prompt, rewrite_parser, rag_chat_prompt, multimodal_rag_chat_prompt
+    get_available_papers, does_file_exist, save_file_to_db, delete_paper_data, close_all_connections
 )
 from app.config_loader import ConfigLoader
 
 from typing import List, Tuple, Optional
-import base64
+import asyncio
+import time
 
-from qdrant_client import QdrantClient, models
-from langchain_community.chat_models import ChatLiteLLM
-from langchain_ollama import OllamaEmbeddings
+from qdrant_client import models
 from langchain_qdrant import QdrantVectorStore
-from langchain_core.vectorstores import VectorStore
+from langchain_core.documents import Document
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
-from langchain_core.output_parsers import StrOutputParser
-
-from transformers import AutoModel, AutoImageProcessor
+from langchain_core.runnables import Runnable
 
 async def rewrite_query(user_query: str, chat_history: List[BaseMessage]) -> str:
     """Rewrite the user query based on the chat history."""
@@ -45,9 +43,10 @@ async def rewrite_query(user_query: str, chat_history: List[BaseMessage]) -> str
     msg_num = cl.user_session.get("configs")['agent_config']['msg_history_len']
     relevant_history = chat_history if len(chat_history) <= msg_num else chat_history[-msg_num:]
     message_history_str = generate_history_str(relevant_history)
-    rewrite_res = rewrite_chain.invoke(
-        {'user_query': user_query, 'user_assistant_conversation': message_history_str}
-    )
+    async with ResourceRegistry().get_backend_limit('llm'):
+        rewrite_res = await rewrite_chain.ainvoke(
+            {'user_query': user_query, 'user_assistant_conversation': message_history_str}
+        )
     return rewrite_res['rewritten_query']
 
 async def generate_context_str(vector_store: QdrantVectorStore, 
@@ -67,20 +66,13 @@ async def generate_context_str(vector_store: QdrantVectorStore,
     if fig_caption:
         context_str += f"FIGURE CAPTION: {fig_caption}\n{'='*25}\n"
     if fig_ref_id:
-        fig_filter=models.Filter(must=[
-            models.FieldCondition(key="metadata.paper_id", match=models.MatchValue(value=paper_id)),
-            models.FieldCondition(key="metadata.fig_ref_ids", match=models.MatchAny(any=[fig_ref_id]))
-        ])
-        figure_docs = await retrieve_context(vector_store, query, k, fig_filter)      
+        figure_docs = await retrieve_context(vector_store, query, k, paper_id, fig_ref_id)
         if figure_docs:
             context_str += f"TEXT DISCUSSING FIGURE {fig_ref_id}:\n"
             docs = figure_docs
     
     if docs is None:
-        doc_filter = models.Filter(must=[
-            models.FieldCondition(key="metadata.paper_id", match=models.MatchValue(value=paper_id))
-        ])
-        docs = await retrieve_context(vector_store, query, k, doc_filter)
+        docs = await retrieve_context(vector_store, query, k, paper_id)
     for i, doc in enumerate(docs):
         # TODO add context expansion (for documents fetched from images)
         context_str += f"CHUNK {i} - FROM CHAPTER {doc.metadata.get('chapter', 'UNKNOWN')}\n{doc.page_content}\n{'='*25}\n"
@@ -97,20 +89,21 @@ async def handle_pdf(file_id: str, element: Element) -> bool:
             return False
         await cl.make_async(save_file_to_db)(file_id, element.name)
         
-        # step 2. convert pdf to markdown, extract figures and captions
-        scraper = cl.user_session.get("scraper")
-        md, img_data = await process_pdf(scraper, element.path)
-
-        # step 3. process md, img_data
-        processor = LangchainProcessor(
-            md,
-            img_data,
-            file_id,
-            cl.user_session.get("text_vs"),
-            cl.user_session.get("img_emb"),
-            cl.user_session.get("img_proc")
-        )
-        await cl.make_async(processor.process)()
+        scraper = await cl.make_async(ResourceRegistry().get_scraper)()
+        if isinstance(scraper, StreamingScraper):
+            # step 2+3. chunk and embed the markdown while the rest of the pdf is being scraped
+            processor = await cl.make_async(create_processor)('', [], file_id, cl.user_session.get("text_vs"))
+            await process_pdf_stream(scraper, processor, element.path)
+        else:
+            # step 2. convert pdf to markdown, extract figures and captions
+            md, img_data = await process_pdf(scraper, element.path)
+
+            # step 3. process md, img_data
+            processor = await cl.make_async(create_processor)(md, img_data, file_id, cl.user_session.get("text_vs"))
+            await cl.make_async(processor.process)()
+
+        # the paper may have been searched while it was being processed
+        invalidate_paper(file_id)
 
         # step 4. add new paper to settings
         papers = await cl.make_async(get_available_papers)()
@@ -121,9 +114,26 @@ async def handle_pdf(file_id: str, element: Element) -> bool:
         return True
     except Exception as e:
         await cl.Message(content=f"An error occurred: {e}. Reset the DB using make cleardb with id={file_id}").send()
-        await cl.make_async(delete_file_from_db)(file_id)
+        # drop everything the failed run stored, so the same pdf can be uploaded again
+        await cl.make_async(delete_paper_data)(file_id)
+        invalidate_paper(file_id)
         return False
 
+def invalidate_paper(paper_id: str) -> None:
+    """Drops the indexed points and the cached query results of a paper after it was (re)ingested or deleted."""
+    for index_key in ("text_index", "image_index"):
+        if cl.user_session.get(index_key) is not None:
+            cl.user_session.get(index_key).invalidate(paper_id)
+    query_cache = ResourceRegistry().get_query_cache()
+    if query_cache is not None:
+        query_cache.invalidate(paper_id)
+
+def create_processor(md: str, img_data: ImageData, file_id: str, text_vs: QdrantVectorStore) -> Processor:
+    """Creates the processor of a new paper. The image model is loaded by the first paper processed."""
+    from app.processor.langchain_processor import LangchainProcessor # ingestion only, imported on first use
+    img_proc, img_emb = ResourceRegistry().get_image_model()
+    return LangchainProcessor(md, img_data, file_id, text_vs, img_emb, img_proc)
+
 async def generate_settings(papers: List[Tuple[str, str]]) -> cl.ChatSettings:
     proc_papers_list = [f"{paper[0]} - {paper[1]}" for paper in papers]
     settings = await cl.ChatSettings(
@@ -139,21 +149,99 @@ async def generate_settings(papers: List[Tuple[str, str]]) -> cl.ChatSettings:
     ).send()
     return settings
 
+async def stream_answer(chain: Runnable, inputs: dict, msg: cl.Message) -> str:
+    """
+    Streams the answer of the chain into the message as tokens arrive, recording the time to first token.
+    When the user stops the response, Chainlit cancels this task, which closes the stream and the LLM request.
+    """
+    start = time.perf_counter()
+    ttft = None
+    try:
+        async with ResourceRegistry().get_backend_limit('llm'):
+            async for token in chain.astream(inputs):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                    print(f"Time to first token: {ttft:.2f}s")
+                await msg.stream_token(token)
+    except asyncio.CancelledError:
+        print(f"Answer cancelled after {time.perf_counter() - start:.2f}s")
+        raise
+    finally:
+        cl.user_session.get("answer_timings").append({'ttft': ttft, 'total': time.perf_counter() - start})
+    await msg.send()
+    print(f"Answer generated in {time.perf_counter() - start:.2f}s")
+    return msg.content
+
+async def embed_query(vector_store: QdrantVectorStore, query: str) -> List[float]:
+    """Embeds the query without blocking the event loop, reusing the embedding of the same query if it is cached."""
+    query_cache = ResourceRegistry().get_query_cache()
+    # keyed on the exact text: the embedding of a query depends on its casing, unlike the normalized search keys
+    key = (None, 'embedding', vector_store.collection_name, query)
+    query_vector = query_cache.get(key) if query_cache is not None else None
+    if query_vector is not None:
+        return query_vector
+    async with ResourceRegistry().get_backend_limit('embedding'):
+        query_vector = await vector_store.embeddings.aembed_query(query)
+    if query_cache is not None:
+        query_cache.put(key, query_vector)
+    return query_vector
+
+async def search_paper(vector_store: QdrantVectorStore,
+                       paper_index: Optional[PaperIndex],
+                       query_vector: List[float],
+                       k: int,
+                       paper_id: str,
+                       fig_ref_id: Optional[str] = None) -> List[Tuple[Document, float]]:
+    """Returns the k documents of the paper most similar to the query vector, with their cosine similarity."""
+    async with ResourceRegistry().get_backend_limit('vector_search'):
+        if paper_index is not None:
+            return await cl.make_async(paper_index.similarity_search_with_score)(paper_id, query_vector, k, fig_ref_id)
+        conditions = [models.FieldCondition(key="metadata.paper_id", match=models.MatchValue(value=paper_id))]
+        if fig_ref_id:
+            conditions.append(models.FieldCondition(key="metadata.fig_ref_ids", match=models.MatchAny(any=[fig_ref_id])))
+        return await cl.make_async(vector_store.similarity_search_with_score_by_vector)(
+            embedding=query_vector,
+            k=k,
+            filter=models.Filter(must=conditions),
+            search_params=get_search_params()
+        )
+
+async def search_paper_by_query(vector_store: QdrantVectorStore,
+                                paper_index: Optional[PaperIndex],
+                                query: str,
+                                k: int,
+                                paper_id: str,
+                                fig_ref_id: Optional[str] = None) -> List[Tuple[Document, float]]:
+    """Same as search_paper for a text query, reusing the results of the same search if they are cached."""
+    query_cache = ResourceRegistry().get_query_cache()
+    key = (paper_id, 'search', vector_store.collection_name, normalize_query(query), k, fig_ref_id)
+    docs = query_cache.get(key) if query_cache is not None else None
+    if docs is not None:
+        return list(docs)
+    # the paper may be invalidated while we search, its results must then not be cached
+    generation = query_cache.get_generation(paper_id) if query_cache is not None else None
+    query_vector = await embed_query(vector_store, query)
+    docs = await search_paper(vector_store, paper_index, query_vector, k, paper_id, fig_ref_id)
+    if query_cache is not None:
+        query_cache.put(key, list(docs), generation)
+    return docs
+
 ## -- CHAINLIT TOOLS -- ##
 
 @cl.step(type="tool")
-async def retrieve_context(vector_store: QdrantVectorStore, query: str, k: int, filter : models.Filter) -> str:
-    docs = await cl.make_async(vector_store.similarity_search)(
-        query=query,
-        k=k,
-        filter=filter
-    )
-    return docs
+async def retrieve_context(vector_store: QdrantVectorStore, query: str, k: int, paper_id: str, fig_ref_id: Optional[str] = None) -> str:
+    docs = await search_paper_by_query(vector_store, cl.user_session.get("text_index"), query, k, paper_id, fig_ref_id)
+    return [doc for doc, _ in docs]
 
 @cl.step(type="tool")
 async def process_pdf(scraper: Scraper, file_path: str) -> Tuple[str, ImageData]:
     return await cl.make_async(scraper.process_document)(file_path)
 
+@cl.step(type="tool")
+async def process_pdf_stream(scraper: StreamingScraper, processor: Processor, file_path: str) -> None:
+    # the scraper runs in a background thread, so the processor can work on the fragments it already yielded
+    await cl.make_async(processor.process_stream)(prefetch(scraper.stream_document(file_path)))
+
 ## -- CHAINLIT MAIN FUNCITONS -- ##
 
 @cl.on_chat_start
@@ -161,48 +249,21 @@ async def on_chat_start():
 
     configs = ConfigLoader().get_config()
     cl.user_session.set("configs", configs)
-    cl.user_session.set("scraper", PapermageScraper())
-
-    text_embed = OllamaEmbeddings(model=configs['embedding_config']['model'])
-    cl.user_session.set("text_embed", text_embed)
-    qdrant_client = QdrantClient(path='app/storage/qdrant/vectorstore')
-    text_vs: VectorStore = QdrantVectorStore(
-        client=qdrant_client,
-        collection_name=configs['qdrant_config']['text_collection_name'],
-        embedding=text_embed
-    )
-    image_vs: VectorStore = QdrantVectorStore(
-        client=qdrant_client,
-        collection_name=configs['qdrant_config']['image_collection_name'],
-        embedding=text_embed
-    )
-
+    # heavy resources are created once per process and shared by every session
+    registry = ResourceRegistry()
+    text_vs = await cl.make_async(registry.get_vector_store)(configs['qdrant_config']['text_collection_name'])
+    image_vs = await cl.make_async(registry.get_vector_store)(configs['qdrant_config']['image_collection_name'])
+    cl.user_session.set("text_embed", text_vs.embeddings)
     cl.user_session.set("text_vs", text_vs)
     cl.user_session.set("image_vs", image_vs)
-    img_proc = AutoImageProcessor.from_pretrained("nomic-ai/nomic-embed-vision-v1.5")
-    img_emb = AutoModel.from_pretrained("nomic-ai/nomic-embed-vision-v1.5", trust_remote_code=True)
-    cl.user_session.set("img_proc", img_proc)
-    cl.user_session.set("img_emb", img_emb)
+    cl.user_session.set("text_index", registry.get_paper_index(configs['qdrant_config']['text_collection_name']))
+    cl.user_session.set("image_index", registry.get_paper_index(configs['qdrant_config']['image_collection_name']))
 
     cl.user_session.set("chat_history", [])
-    api_base = None
-    if configs['agent_config']['api_base'] != "":
-        api_base = configs['agent_config']['api_base']
-    chat_llm = ChatLiteLLM(
-        model=configs['agent_config']['model_name'], 
-        temperature=configs['agent_config']['temperature'],
-        api_base=api_base,
-    )
-    cl.user_session.set("chat_llm", chat_llm)
-
-    rewrite_chain = rewrite_chat_prompt | chat_llm | rewrite_parser
-    cl.user_session.set("rewrite_chain", rewrite_chain)
-
-    rag_chain = rag_chat_prompt | chat_llm | StrOutputParser()
-    cl.user_session.set("rag_chain", rag_chain)
-
-    multimodal_rag_chain = multimodal_rag_chat_prompt | chat_llm | StrOutputParser()
-    cl.user_session.set("multimodal_rag_chain", multimodal_rag_chain)
+    cl.user_session.set("answer_timings", []) # time to first token and total time of every answer
+    cl.user_session.set("chat_llm", await cl.make_async(registry.get_chat_llm)())
+    for chain_name, chain in (await cl.make_async(registry.get_chains)()).items():
+        cl.user_session.set(chain_name, chain)
 
     await cl.context.emitter.set_commands([
         {
@@ -232,6 +293,7 @@ async def on_chat_start():
 async def main(message: cl.Message):
     
     img_data = None
+    img_mime = None
     image_element = None
     fig_ref_id = None
     fig_caption = None
@@ -243,8 +305,7 @@ async def main(message: cl.Message):
                 res = await handle_pdf(file_id, element)
                 return
             elif element.mime == 'image':
-                with open(element.path, "rb") as f:
-                    img_data = base64.b64encode(f.read()).decode("utf-8")
+                img_mime, img_data = await cl.make_async(get_image_payload)(element.path)
 
     # handle message
     paper_id = cl.user_session.get("paper_settings")['paper'].split(" - ")[0]
@@ -255,20 +316,18 @@ async def main(message: cl.Message):
         print(f"User query rewritten: {user_msg}")
 
     if img_data is None and message.command == "img_search":
-        img_vs : VectorStore = cl.user_session.get("image_vs")
-        img_docs = await cl.make_async(img_vs.similarity_search_with_relevance_scores)(
-            query=user_msg,
-            k=1,
-            score_threshold=cl.user_session.get("configs")['agent_config']['img_sim_threshold'],
-            filter = models.Filter(must=[
-                models.FieldCondition(key="metadata.paper_id", match=models.MatchValue(value=paper_id))
-            ])
-        )
+        img_vs : QdrantVectorStore = cl.user_session.get("image_vs")
+        img_sim_threshold = cl.user_session.get("configs")['agent_config']['img_sim_threshold']
+        img_docs = await search_paper_by_query(img_vs, cl.user_session.get("image_index"), user_msg, 1, paper_id)
+        # same relevance score as QdrantVectorStore.similarity_search_with_relevance_scores for cosine
+        img_docs = [(doc, (score + 1.0) / 2.0) for doc, score in img_docs]
+        img_docs = [(doc, score) for doc, score in img_docs if score >= img_sim_threshold]
         if len(img_docs) > 0:
             print(f"Image docs similarity: {img_docs[0][1]}")
             img_doc = img_docs[0][0]
-            with open(img_doc.metadata['path'], "rb") as f:
-                img_data = base64.b64encode(f.read()).decode("utf-8")
+            # papers processed before the figure store have no LLM variant
+            llm_path = img_doc.metadata.get('llm_path', img_doc.metadata['path'])
+            img_mime, img_data = await cl.make_async(get_image_payload)(llm_path)
             image_element = cl.Image(path=img_doc.metadata['path'], name="Retrieved Image", display="inline")
             fig_ref_id = img_doc.metadata.get('fig_ref_id', None)
             fig_caption = img_doc.metadata.get('caption', None)
@@ -285,22 +344,14 @@ async def main(message: cl.Message):
 
     # print(f"Context string: {context_str}")
 
-    response = ''
     if img_data:
-        multimodal_rag_chain = cl.user_session.get("multimodal_rag_chain")
-        response = multimodal_rag_chain.invoke(
-            {'context': context_str, 'user_query': user_msg, 'image_data': img_data}
-        )
+        chain = cl.user_session.get("multimodal_rag_chain")
+        inputs = {'context': context_str, 'user_query': user_msg, 'image_mime': img_mime, 'image_data': img_data}
     else:
-        rag_chain = cl.user_session.get("rag_chain")
-        response = rag_chain.invoke(
-            {'context': context_str, 'user_query': user_msg}
-        )
-    
-    await cl.Message(
-        content=response, 
-        elements=[image_element] if image_element else []
-    ).send()
+        chain = cl.user_session.get("rag_chain")
+        inputs = {'context': context_str, 'user_query': user_msg}
+    msg = cl.Message(content='', elements=[image_element] if image_element else [])
+    response = await stream_answer(chain, inputs, msg)
 
     chat_history.append(HumanMessage(content=user_msg))
     chat_history.append(AIMessage(content=response))